@@ -1,15 +1,25 @@
-from fastapi import Depends, FastAPI, HTTPException, Query, UploadFile, File, Form, Body
+from fastapi import Depends, FastAPI, HTTPException, Header, Query, UploadFile, File, Form, Body
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, ForeignKey, Text, Float, text
+from fastapi.responses import Response
+from sqlalchemy import create_engine, event, Index, Column, Integer, String, Boolean, DateTime, ForeignKey, Text, Float, text, func, case, or_, select, insert, update, delete, tuple_, inspect as sa_inspect
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session, relationship, joinedload, subqueryload, selectinload
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.pool import NullPool
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from datetime import datetime, timedelta
-from typing import List, Optional, Dict, Any
-from pydantic import BaseModel
+from typing import List, Optional, Dict, Any, Union
+from collections import defaultdict
+from pydantic import BaseModel, TypeAdapter
+from pydantic_core import from_json, to_json
 import json
 from dateutil import parser as date_parser
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
+import anyio
+import asyncio
 import firebase_admin
 from firebase_admin import credentials, messaging
 import pytz
@@ -19,13 +29,42 @@ import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import random
+import re
+import hashlib
+import hmac
+import secrets
+import shutil
 import string
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from cachetools import TTLCache
+import logging
+import logging.handlers
+import queue
+import atexit
+
+# Logging: request threads only enqueue records; a background listener does the stream I/O
+logger = logging.getLogger("pollplay")
+logger.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+logger.propagate = False
+if not logger.handlers:
+    log_queue = queue.SimpleQueue()
+    log_stream = logging.StreamHandler()
+    log_stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    log_listener = logging.handlers.QueueListener(log_queue, log_stream)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    log_listener.start()
+    atexit.register(log_listener.stop)
 
 # Set IST timezone
 IST = pytz.timezone('Asia/Kolkata')
 
 # Prepare uploads directory (safe before app creation)
 Path("uploads/voice").mkdir(parents=True, exist_ok=True)
+# In-progress voice uploads; a sibling of uploads (same filesystem for the final rename) but outside the static mount
+Path("uploads_tmp/voice").mkdir(parents=True, exist_ok=True)
 
 DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///./poll_play.db")
 
@@ -39,12 +78,42 @@ try:
 except Exception:
     normalized_url = DATABASE_URL
 
+# Keep a warm pool of connections per worker instead of reconnecting per request.
+# Sizes are per worker process; set DB_NULL_POOL=1 when an external pooler (e.g. PgBouncer) sits in front.
+# Overflow covers bursts from the threadpool (THREADPOOL_SIZE workers) so they queue less on pool_timeout.
+if os.environ.get("DB_NULL_POOL") == "1":
+    pool_settings = {"poolclass": NullPool}
+else:
+    pool_settings = {
+        "pool_size": int(os.environ.get("DB_POOL_SIZE", "20")),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", "40")),
+        "pool_timeout": int(os.environ.get("DB_POOL_TIMEOUT", "30")),
+        "pool_pre_ping": True,
+        "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", "3600")),
+    }
+
 if normalized_url.startswith("sqlite"):
-    engine = create_engine(normalized_url, connect_args={"check_same_thread": False})
+    engine = create_engine(normalized_url, connect_args={"check_same_thread": False}, insertmanyvalues_page_size=1000, **pool_settings)
+
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_conn, _):
+        """WAL lets readers run during writes; NORMAL sync is safe under WAL and fsyncs less.
+        foreign_keys stays off: delete_user and several writes don't clean up or check dependent rows yet.
+        """
+        cur = dbapi_conn.cursor()
+        for pragma in ("journal_mode=WAL", "synchronous=NORMAL", "temp_store=MEMORY", "cache_size=-65536", "mmap_size=268435456"):
+            cur.execute(f"PRAGMA {pragma}")
+        cur.close()
 else:
-    engine = create_engine(normalized_url)
+    engine = create_engine(normalized_url, insertmanyvalues_page_size=1000, **pool_settings)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+def upsert_insert(model):
+    """INSERT construct for the active dialect, supporting on_conflict_do_update/do_nothing."""
+    if engine.dialect.name == "postgresql":
+        return postgresql_insert(model)
+    return sqlite_insert(model)
+
 Base = declarative_base()
 
 # Models
@@ -91,7 +160,7 @@ class PollDB(Base):
     description = Column(Text)
     category = Column(String)
     thumbnail = Column(String)
-    createdAt = Column(DateTime)
+    createdAt = Column(DateTime, index=True)
     disableVoiceComments = Column(Boolean, default=False)
     options = relationship("PollOptionDB", back_populates="poll")
     comments = relationship("CommentDB", back_populates="poll")
@@ -103,8 +172,14 @@ class PollOptionDB(Base):
     text = Column(String)
     imageUrl = Column(String)
     votes = Column(Integer, default=0)
-    votedBy = Column(Text, default="[]")
     poll = relationship("PollDB", back_populates="options")
+    voteRecords = relationship("VoteDB", cascade="all, delete-orphan")
+
+class VoteDB(Base):
+    __tablename__ = "votes"
+    user_id = Column(String, primary_key=True)
+    option_id = Column(String, ForeignKey('poll_options.id'), primary_key=True)
+    poll_id = Column(String, index=True)
 
 class CommentDB(Base):
     __tablename__ = "comments"
@@ -115,13 +190,19 @@ class CommentDB(Base):
     audio_url = Column(String, nullable=True)
     timestamp = Column(DateTime)
     likes = Column(Integer, default=0)
-    likedBy = Column(Text, default="[]")
     parent_id = Column(String, ForeignKey('comments.id'), nullable=True)
     flaggedForReview = Column(Boolean, default=False)
     reviewReason = Column(String, nullable=True)
     poll = relationship("PollDB", back_populates="comments")
     user = relationship("UserDB")
     replies = relationship("CommentDB")
+    __table_args__ = (Index("ix_comments_poll_parent", "poll_id", "parent_id"),)
+    likeRecords = relationship("CommentLikeDB", cascade="all, delete-orphan")
+
+class CommentLikeDB(Base):
+    __tablename__ = "comment_likes"
+    user_id = Column(String, primary_key=True)
+    comment_id = Column(String, ForeignKey('comments.id'), primary_key=True)
 
 class ReportDB(Base):
     __tablename__ = "reports"
@@ -165,11 +246,13 @@ class GameResultDB(Base):
     coinsWon = Column(Integer)
     playedAt = Column(DateTime)
     user = relationship("UserDB")
+    # Serves per-user history (ORDER BY playedAt DESC via a backward scan) and today's range count
+    __table_args__ = (Index("ix_game_results_user_playedat", "user_id", "playedAt"),)
 
 class DeviceTokenDB(Base):
     __tablename__ = "device_tokens"
     id = Column(String, primary_key=True)
-    user_id = Column(String, ForeignKey('users.id'))
+    user_id = Column(String, ForeignKey('users.id'), index=True)
     token = Column(String, unique=True)
     platform = Column(String)  # ios or android
     createdAt = Column(DateTime, default=lambda: datetime.now(IST))
@@ -188,6 +271,7 @@ class AdsStatsDB(Base):
     watched = Column(Integer, default=0)
     coins = Column(Integer, default=0)
     user = relationship("UserDB")
+    __table_args__ = (Index("ix_ads_user_date", "user_id", "date", unique=True),)
 
 # Chat/E2E models
 class UserPublicKeyDB(Base):
@@ -208,6 +292,13 @@ class MessageDB(Base):
     readAt = Column(DateTime, nullable=True)
     audioUrl = Column(String, nullable=True)
     audioDuration = Column(Float, default=0.0)
+    __table_args__ = (
+        Index("ix_msg_conv", "sender_id", "recipient_id", "createdAt"),
+        Index("ix_msg_recv", "recipient_id", "sender_id", "createdAt"),
+        # Partial: unread counts only scan rows that are still unread
+        Index("ix_msg_unread", "recipient_id", "sender_id",
+              postgresql_where=text('"readAt" IS NULL'), sqlite_where=text('"readAt" IS NULL')),
+    )
 
 Base.metadata.create_all(bind=engine)
 
@@ -220,65 +311,120 @@ def migrate_database():
         is_postgres = 'postgresql' in str(engine.url)
         
         # Migration 1: Add successfulRedemptions column to users table
+        # (idempotent DDL instead of a failing probe query, which aborts the transaction on Postgres)
         try:
-            db.execute(text("SELECT \"successfulRedemptions\" FROM users LIMIT 1"))
-            db.commit()  # Commit successful check
-            print("[MIGRATION] successfulRedemptions column already exists")
+            if is_postgres:
+                db.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS \"successfulRedemptions\" INTEGER DEFAULT 0"))
+            elif "successfulRedemptions" not in {c["name"] for c in sa_inspect(engine).get_columns("users")}:
+                # SQLite has no ADD COLUMN IF NOT EXISTS
+                db.execute(text("ALTER TABLE users ADD COLUMN successfulRedemptions INTEGER DEFAULT 0"))
+            db.commit()
+            logger.info("[MIGRATION] ✓ successfulRedemptions column ready")
         except Exception as e:
-            # CRITICAL: Rollback failed transaction before attempting ALTER
+            logger.warning("[MIGRATION] ✗ Failed to add column: %s", e)
             db.rollback()
-            print(f"[MIGRATION] Column not found, adding it... ({type(e).__name__})")
-            try:
-                if is_postgres:
-                    db.execute(text("ALTER TABLE users ADD COLUMN \"successfulRedemptions\" INTEGER DEFAULT 0"))
-                else:
-                    db.execute(text("ALTER TABLE users ADD COLUMN successfulRedemptions INTEGER DEFAULT 0"))
-                db.commit()
-                print("[MIGRATION] ✓ successfulRedemptions column added successfully")
-            except Exception as e2:
-                print(f"[MIGRATION] ✗ Failed to add column: {e2}")
-                db.rollback()
-        
+
         # Migration 2: Create otps table if it doesn't exist
         try:
-            db.execute(text("SELECT * FROM otps LIMIT 1"))
-            db.commit()  # Commit successful check
-            print("[MIGRATION] otps table already exists")
+            if is_postgres:
+                db.execute(text("""
+                    CREATE TABLE IF NOT EXISTS otps (
+                        id SERIAL PRIMARY KEY,
+                        email VARCHAR,
+                        otp_code VARCHAR,
+                        created_at TIMESTAMP WITH TIME ZONE,
+                        expires_at TIMESTAMP WITH TIME ZONE,
+                        is_used BOOLEAN DEFAULT FALSE
+                    )
+                """))
+            else:
+                db.execute(text("""
+                    CREATE TABLE IF NOT EXISTS otps (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        email VARCHAR,
+                        otp_code VARCHAR,
+                        created_at DATETIME,
+                        expires_at DATETIME,
+                        is_used BOOLEAN DEFAULT 0
+                    )
+                """))
+            db.commit()
+            logger.info("[MIGRATION] ✓ otps table ready")
         except Exception as e:
-            # CRITICAL: Rollback failed transaction before attempting CREATE
+            logger.warning("[MIGRATION] ✗ Failed to create table: %s", e)
             db.rollback()
-            print(f"[MIGRATION] Table not found, creating it... ({type(e).__name__})")
+
+        # Migration 3: Merge duplicate ads_stats rows so the unique (user_id, date) index can be built
+        try:
+            duplicates = db.execute(text(
+                "SELECT user_id, date, MIN(id), SUM(watched), SUM(coins) FROM ads_stats "
+                "GROUP BY user_id, date HAVING COUNT(*) > 1"
+            )).fetchall()
+            for user_id, date, keep_id, watched, coins in duplicates:
+                db.execute(text("UPDATE ads_stats SET watched = :w, coins = :c WHERE id = :id"), {"w": watched, "c": coins, "id": keep_id})
+                db.execute(text("DELETE FROM ads_stats WHERE user_id = :u AND date = :d AND id <> :id"), {"u": user_id, "d": date, "id": keep_id})
+            db.commit()
+            if duplicates:
+                logger.info("[MIGRATION] ✓ Merged %s duplicate ads_stats group(s)", len(duplicates))
+        except Exception as e:
+            logger.warning("[MIGRATION] ✗ Failed to merge duplicate ads_stats rows: %s", e)
+            db.rollback()
+
+        # Migration 4: Create indexes declared on models for tables that already existed
+        # (create_all only creates indexes together with new tables)
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                try:
+                    index.create(bind=engine, checkfirst=True)
+                except Exception as e:
+                    logger.warning("[MIGRATION] ✗ Failed to create index %s: %s", index.name, e)
+
+        # Migration 5: Move JSON votedBy/likedBy lists into the votes/comment_likes tables
+        legacy_columns = (
+            ("poll_options", "votedBy", VoteDB, "option_id",
+             lambda row, uid: {"user_id": uid, "option_id": row[0], "poll_id": row[1]}),
+            ("comments", "likedBy", CommentLikeDB, "comment_id",
+             lambda row, uid: {"user_id": uid, "comment_id": row[0]}),
+        )
+        for table, column, model, key_column, make_row in legacy_columns:
+            # Skip once the column is dropped (or on fresh databases that never had it)
+            if column not in {c["name"] for c in sa_inspect(engine).get_columns(table)}:
+                continue
             try:
-                if is_postgres:
-                    db.execute(text("""
-                        CREATE TABLE otps (
-                            id SERIAL PRIMARY KEY,
-                            email VARCHAR,
-                            otp_code VARCHAR,
-                            created_at TIMESTAMP WITH TIME ZONE,
-                            expires_at TIMESTAMP WITH TIME ZONE,
-                            is_used BOOLEAN DEFAULT FALSE
-                        )
-                    """))
-                else:
-                    db.execute(text("""
-                        CREATE TABLE otps (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            email VARCHAR,
-                            otp_code VARCHAR,
-                            created_at DATETIME,
-                            expires_at DATETIME,
-                            is_used BOOLEAN DEFAULT 0
-                        )
-                    """))
+                rows = db.execute(text(f'SELECT id, poll_id, "{column}" FROM {table}')).fetchall()
+                existing = {tuple(r) for r in db.execute(text(f"SELECT user_id, {key_column} FROM {model.__tablename__}")).fetchall()}
+                mappings = []
+                for row in rows:
+                    try:
+                        user_ids = json.loads(row[2] or "[]")
+                    except Exception:
+                        user_ids = []
+                    if not isinstance(user_ids, list):
+                        continue
+                    for uid in dict.fromkeys(user_ids):
+                        if (uid, row[0]) not in existing:
+                            existing.add((uid, row[0]))
+                            mappings.append(make_row(row, uid))
+                if mappings:
+                    db.bulk_insert_mappings(model, mappings)
+                # Clear the legacy column so a re-run never backfills twice, even if the drop fails
+                db.execute(text(f'UPDATE {table} SET "{column}" = NULL'))
                 db.commit()
-                print("[MIGRATION] ✓ otps table created successfully")
-            except Exception as e2:
-                print(f"[MIGRATION] ✗ Failed to create table: {e2}")
+                logger.info("[MIGRATION] ✓ Moved %s %s entries into %s", len(mappings), column, model.__tablename__)
+            except Exception as e:
+                logger.warning("[MIGRATION] ✗ Failed to backfill %s: %s", column, e)
                 db.rollback()
-            
+                continue
+            try:
+                db.execute(text(f'ALTER TABLE {table} DROP COLUMN "{column}"'))
+                db.commit()
+                logger.info("[MIGRATION] ✓ Dropped %s.%s", table, column)
+            except Exception as e:
+                logger.warning("[MIGRATION] ✗ Failed to drop %s.%s: %s", table, column, e)
+                db.rollback()
+
     except Exception as e:
-        print(f"[MIGRATION] ✗ Unexpected error during migration: {e}")
+        logger.error("[MIGRATION] ✗ Unexpected error during migration: %s", e)
         db.rollback()
     finally:
         db.close()
@@ -286,43 +432,35 @@ def migrate_database():
 # Run migrations
 migrate_database()
 
-# Initialize Firebase Admin SDK
-try:
-    # Load Firebase configuration from backend.json only
-    import json
-    with open("backend.json", "r") as f:
-        firebase_config = json.load(f)
-
-    cred = credentials.Certificate(firebase_config)
-    firebase_admin.initialize_app(cred)
-    print("Firebase initialized successfully with backend.json configuration")
-    print(f"Project ID: {firebase_config.get('project_id', 'unknown')}")
-
-except Exception as e:
-    print(f"Failed to load Firebase configuration from backend.json: {e}")
-    print("Push notifications will not work without proper Firebase configuration")
-
-# Seed default admin
-db = SessionLocal()
-admin = db.query(UserDB).filter(UserDB.email == "admin@admin.com").first()
-if not admin:
-    admin = UserDB(
-        id="admin-1",
-        name="Admin",
-        email="admin@admin.com",
-        password="admin",  # In production, hash this
-        avatar="https://i.pravatar.cc/150?u=admin",
-        isAdmin=True,
-        coins=9999,
-        dailyAttempts=3,
-        lastAttemptDate=datetime.now(IST),
-        isBanned=False
-    )
-    db.add(admin)
-    db.commit()
+# Firebase Admin SDK is initialized lazily by get_firebase_app() on first push/test call
+
+# Password hashing (PBKDF2-SHA256, stdlib). Rows still holding a plaintext password are
+# verified as before and rehashed on their next successful login.
+PASSWORD_HASH_PREFIX = "pbkdf2_sha256"
+PASSWORD_HASH_ITERATIONS = 260000
+
+def hash_password(password: str) -> str:
+    salt = secrets.token_hex(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt.encode(), PASSWORD_HASH_ITERATIONS).hex()
+    return f"{PASSWORD_HASH_PREFIX}${PASSWORD_HASH_ITERATIONS}${salt}${digest}"
+
+def is_password_hash(value: Optional[str]) -> bool:
+    return bool(value) and value.startswith(PASSWORD_HASH_PREFIX + "$")
+
+def verify_password(password: str, stored: Optional[str]) -> bool:
+    if not stored:
+        return False
+    if not is_password_hash(stored):
+        return hmac.compare_digest(password.encode(), stored.encode())
+    try:
+        _, iterations, salt, digest = stored.split("$")
+        candidate = hashlib.pbkdf2_hmac("sha256", password.encode(), salt.encode(), int(iterations)).hex()
+    except ValueError:
+        return False
+    return hmac.compare_digest(candidate, digest)
 
-# Seed default categories
-categories_to_seed = [
+# Seed default admin and categories
+DEFAULT_CATEGORIES = [
     {"id": "cat-tech", "name": "Technology"},
     {"id": "cat-games", "name": "Games"},
     {"id": "cat-lifestyle", "name": "Lifestyle"},
@@ -337,13 +475,30 @@ categories_to_seed = [
     {"id": "cat-business", "name": "Business"},
 ]
 
-for cat_data in categories_to_seed:
-    existing_cat = db.query(CategoryDB).filter(CategoryDB.id == cat_data["id"]).first()
-    if not existing_cat:
-        cat = CategoryDB(id=cat_data["id"], name=cat_data["name"])
-        db.add(cat)
+def seed_defaults():
+    """Insert the default admin and categories if missing: one INSERT ... ON CONFLICT DO NOTHING per table"""
+    db = SessionLocal()
+    try:
+        db.execute(upsert_insert(UserDB).values(
+            id="admin-1",
+            name="Admin",
+            email="admin@admin.com",
+            password="admin",  # Rehashed on first login
+            avatar="https://i.pravatar.cc/150?u=admin",
+            isAdmin=True,
+            coins=9999,
+            dailyAttempts=3,
+            lastAttemptDate=datetime.now(IST),
+            isBanned=False,
+        ).on_conflict_do_nothing())
+        db.execute(upsert_insert(CategoryDB).values(DEFAULT_CATEGORIES).on_conflict_do_nothing())
+        db.commit()
+    finally:
+        db.close()
 
-db.commit()
+# Set SEED_DEFAULTS=0 on extra workers/replicas once the database has been seeded
+if os.environ.get("SEED_DEFAULTS", "1") == "1":
+    seed_defaults()
 
 # Pydantic
 
@@ -390,7 +545,7 @@ class Comment(BaseModel):
     flaggedForReview: bool = False
     reviewReason: Optional[str] = None
 
-Comment.update_forward_refs()
+Comment.model_rebuild()
 
 class Poll(BaseModel):
     id: str
@@ -403,6 +558,16 @@ class Poll(BaseModel):
     createdAt: str
     disableVoiceComments: bool = False
 
+class PollWriteAck(BaseModel):
+    """Compact acknowledgement for poll writes (?compact=true) instead of the full poll"""
+    success: bool = True
+    pollId: str
+    optionId: Optional[str] = None
+    votes: Optional[int] = None
+    coins: Optional[int] = None
+    commentId: Optional[str] = None
+    likes: Optional[int] = None
+
 class Category(BaseModel):
     id: str
     name: str
@@ -493,6 +658,9 @@ class SendMessageBody(BaseModel):
     ivBase64: str
     createdAt: str
 
+class BulkMessagesBody(BaseModel):
+    messages: List[SendMessageBody]
+
 class MessageItem(BaseModel):
     id: str
     senderId: str
@@ -510,9 +678,32 @@ class ConversationItem(BaseModel):
     lastMessageAt: str
     unreadCount: int
 
+# Serializers for cached read endpoints and large list responses
+poll_adapter = TypeAdapter(Poll)
+polls_adapter = TypeAdapter(List[Poll])
+categories_adapter = TypeAdapter(List[Category])
+reports_adapter = TypeAdapter(List[Report])
+redemption_requests_adapter = TypeAdapter(List[RedemptionRequest])
+game_results_adapter = TypeAdapter(List[GameResult])
+messages_adapter = TypeAdapter(List[MessageItem])
+analytics_adapter = TypeAdapter(List[Dict[str, Any]])
+
+def json_response(adapter: TypeAdapter, value) -> Response:
+    """Serialize value in one pass with a prebuilt adapter; FastAPI skips response_model re-validation for a Response"""
+    return Response(content=adapter.dump_json(value), media_type="application/json")
+
 # App
 
-app = FastAPI()
+# Sync endpoints run in AnyIO's worker threads (default limit 40). Size it so requests waiting on
+# blocking I/O (FCM, SMTP) don't starve DB work; DB concurrency itself is bounded by the pool.
+THREADPOOL_SIZE = int(os.environ.get("THREADPOOL_SIZE", "100"))
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    yield
+
+app = FastAPI(lifespan=lifespan)
 
 # Mount uploads static after app is created
 app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
@@ -526,12 +717,54 @@ app.add_middleware(
 )
 
 def get_db():
+    """One session per request: FastAPI caches this dependency for the whole request.
+    Not a thread-local scoped_session, since sync dependencies and endpoints may run on different threadpool threads.
+    """
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
 
+# Read cache for poll/category listings; any write that changes them clears it
+READ_CACHE_TTL_SECONDS = 30
+read_cache = TTLCache(maxsize=256, ttl=READ_CACHE_TTL_SECONDS)
+read_cache_lock = threading.Lock()
+read_cache_generation = 0
+
+def invalidate_read_cache():
+    global read_cache_generation
+    with read_cache_lock:
+        read_cache_generation += 1
+        read_cache.clear()
+
+async def cached_read(key, adapter: TypeAdapter, fn, *args) -> Response:
+    """Return the cached JSON for key, or load it via run_with_session(fn, *args) and cache it.
+    The result is serialized once with adapter (in the threadpool), so cache hits skip validation and encoding.
+    Results loaded while a write invalidated the cache are returned but not stored.
+    """
+    with read_cache_lock:
+        generation = read_cache_generation
+        body = read_cache.get(key)
+    if body is None:
+        body = await run_with_session(lambda db: adapter.dump_json(fn(db, *args)))
+        with read_cache_lock:
+            if generation == read_cache_generation:
+                read_cache[key] = body
+    return Response(content=body, media_type="application/json")
+
+async def run_with_session(fn, *args):
+    """Run fn(db, *args) in the threadpool with its own session.
+    Used by async read endpoints so the connection goes back to the pool before the response is serialized.
+    """
+    def call():
+        db = SessionLocal()
+        try:
+            return fn(db, *args)
+        finally:
+            db.close()
+    return await run_in_threadpool(call)
+
 # Email Configuration
 SMTP_SERVER = os.environ.get("SMTP_SERVER", "smtp.gmail.com")
 SMTP_PORT = int(os.environ.get("SMTP_PORT", "587"))
@@ -542,6 +775,35 @@ OTP_EXPIRY_MINUTES = 10
 
 # Helper Functions
 
+def parse_timestamp(value: str) -> datetime:
+    """Parse an incoming ISO-8601 timestamp with the C fromisoformat; fall back to dateutil for other formats."""
+    try:
+        # fromisoformat only accepts a trailing "Z" from Python 3.11
+        if value.endswith("Z"):
+            return datetime.fromisoformat(value[:-1] + "+00:00")
+        return datetime.fromisoformat(value)
+    except (AttributeError, TypeError, ValueError):
+        return date_parser.parse(value)
+
+def adjust_user_coins(db: Session, user_id: str, delta: int, require_balance: bool = False) -> Optional[int]:
+    """Add delta to a user's coins with a single UPDATE ... RETURNING and return the new balance.
+    With require_balance the update only applies if the balance covers -delta.
+    Returns None when no row was updated (unknown user or insufficient coins).
+    """
+    stmt = update(UserDB).where(UserDB.id == user_id)
+    if require_balance:
+        stmt = stmt.where(func.coalesce(UserDB.coins, 0) >= -delta)
+    stmt = stmt.values(coins=func.coalesce(UserDB.coins, 0) + delta).returning(UserDB.coins)
+    return db.execute(stmt, execution_options={"synchronize_session": False}).scalar()
+
+def ensure_message_users(db: Session, sender_id: str, recipient_id: str) -> None:
+    """Check sender and recipient exist with one IN query; raise 404 for whichever is missing."""
+    found = set(db.execute(select(UserDB.id).where(UserDB.id.in_([sender_id, recipient_id]))).scalars().all())
+    if sender_id not in found:
+        raise HTTPException(status_code=404, detail="Sender not found")
+    if recipient_id not in found:
+        raise HTTPException(status_code=404, detail="Recipient not found")
+
 def generate_otp(length=6):
     """Generate a random OTP code"""
     return ''.join(random.choices(string.digits, k=length))
@@ -550,7 +812,7 @@ def send_otp_email(recipient_email: str, otp_code: str):
     """Send OTP via email"""
     try:
         if not SMTP_USERNAME or not SMTP_PASSWORD:
-            print("[EMAIL] SMTP credentials not configured")
+            logger.warning("[EMAIL] SMTP credentials not configured")
             return False
         
         msg = MIMEMultipart('alternative')
@@ -594,18 +856,23 @@ def send_otp_email(recipient_email: str, otp_code: str):
             server.login(SMTP_USERNAME, SMTP_PASSWORD)
             server.send_message(msg)
         
-        print(f"[EMAIL] OTP sent successfully to {recipient_email}")
+        logger.info("[EMAIL] OTP sent successfully to %s", recipient_email)
         return True
     except Exception as e:
-        print(f"[EMAIL] Failed to send OTP: {e}")
+        logger.warning("[EMAIL] Failed to send OTP: %s", e)
         return False
 
+@lru_cache(maxsize=1024)
+def parse_specializations(raw: str) -> tuple:
+    """Decode the specializations JSON column; memoized since few distinct values repeat across users."""
+    return tuple(json.loads(raw))
+
 def db_to_user(user_db):
     return User(
         id=user_db.id,
         name=user_db.name,
         email=user_db.email,
-        password=user_db.password,
+        password="",  # never expose the stored hash
         avatar=user_db.avatar,
         isAdmin=user_db.isAdmin,
         coins=user_db.coins,
@@ -615,24 +882,26 @@ def db_to_user(user_db):
         mobile=user_db.mobile,
         gender=user_db.gender,
         bio=user_db.bio,
-        specializations=json.loads(user_db.specializations) if user_db.specializations else None,
+        specializations=list(parse_specializations(user_db.specializations)) if user_db.specializations else None,
         referralCode=user_db.referralCode,
         referredBy=user_db.referredBy,
         successfulRedemptions=user_db.successfulRedemptions or 0,
     )
 
+def poll_load_options():
+    """Eager-load options for serializing polls: options (with votes) and comments (with users) in batched IN queries"""
+    return (selectinload(PollDB.options).selectinload(PollOptionDB.voteRecords), selectinload(PollDB.comments).joinedload(CommentDB.user))
+
 def db_to_poll(poll_db, db):
     options = []
     for opt in poll_db.options:
-        # Be resilient to corrupted or null votedBy
-        try:
-            votedBy = json.loads(opt.votedBy or "[]")
-            if not isinstance(votedBy, list):
-                votedBy = []
-        except Exception:
-            votedBy = []
+        votedBy = [v.user_id for v in opt.voteRecords]
         options.append(PollOption(id=opt.id, text=opt.text, imageUrl=opt.imageUrl, votes=opt.votes or 0, votedBy=votedBy))
-    comments = []
+    # poll_db.comments holds the whole tree (replies share poll_id); group it by parent.
+    # Read endpoints eager-load it via poll_load_options() so no extra query is issued here.
+    children: Dict[Optional[str], List[CommentDB]] = defaultdict(list)
+    for c in poll_db.comments:
+        children[c.parent_id].append(c)
     def build_comments(comment_db):
         # Guard against missing related user records
         if comment_db.user is None:
@@ -644,11 +913,9 @@ def db_to_poll(poll_db, db):
             ts = comment_db.timestamp.isoformat() if comment_db.timestamp else datetime.now(IST).isoformat()
         except Exception:
             ts = datetime.now(IST).isoformat()
-        replies = [build_comments(r) for r in db.query(CommentDB).filter(CommentDB.parent_id == comment_db.id).all()]
+        replies = [build_comments(r) for r in children.get(comment_db.id, [])]
         return Comment(id=comment_db.id, user=user, text=comment_db.text, audio_url=comment_db.audio_url, timestamp=ts, likes=comment_db.likes or 0, replies=replies, flaggedForReview=comment_db.flaggedForReview, reviewReason=comment_db.reviewReason)
-    top_comments = db.query(CommentDB).filter(CommentDB.poll_id == poll_db.id, CommentDB.parent_id == None).all()
-    for c in top_comments:
-        comments.append(build_comments(c))
+    comments = [build_comments(c) for c in children.get(None, [])]
     # Safely handle missing createdAt
     try:
         created_at_str = poll_db.createdAt.isoformat() if poll_db.createdAt else datetime.now(IST).isoformat()
@@ -656,12 +923,52 @@ def db_to_poll(poll_db, db):
         created_at_str = datetime.now(IST).isoformat()
     return Poll(id=poll_db.id, title=poll_db.title, description=poll_db.description, category=poll_db.category, thumbnail=poll_db.thumbnail, options=options, comments=comments, createdAt=created_at_str, disableVoiceComments=poll_db.disableVoiceComments)
 
+firebase_init_lock = threading.Lock()
+FCM_MULTICAST_LIMIT = 500  # max tokens per FCM multicast request
+FCM_MAX_PARALLEL_BATCHES = 4
+
+# Broadcast targets (token, platform), cached briefly instead of scanning device_tokens per push.
+# Registrations and pruning on this worker evict it; the TTL bounds staleness on other workers.
+DEVICE_TOKENS_CACHE_TTL_SECONDS = 60
+device_tokens_cache = TTLCache(maxsize=1, ttl=DEVICE_TOKENS_CACHE_TTL_SECONDS)
+device_tokens_cache_lock = threading.Lock()
+
+def load_device_tokens(db: Session) -> List[tuple]:
+    with device_tokens_cache_lock:
+        tokens = device_tokens_cache.get("all_tokens")
+    if tokens is None:
+        tokens = [tuple(row) for row in db.query(DeviceTokenDB.token, DeviceTokenDB.platform).all()]
+        with device_tokens_cache_lock:
+            device_tokens_cache["all_tokens"] = tokens
+    return tokens
+
+def invalidate_device_tokens():
+    with device_tokens_cache_lock:
+        device_tokens_cache.pop("all_tokens", None)
+
+def get_firebase_app():
+    """Initialize Firebase Admin from backend.json on first use. Returns None if unavailable."""
+    with firebase_init_lock:
+        if firebase_admin._apps:
+            return firebase_admin.get_app()
+        try:
+            with open("backend.json", "r") as f:
+                firebase_config = json.load(f)
+            app = firebase_admin.initialize_app(credentials.Certificate(firebase_config))
+            logger.info("Firebase initialized successfully with backend.json configuration")
+            logger.info("Project ID: %s", firebase_config.get('project_id', 'unknown'))
+            return app
+        except Exception as e:
+            logger.warning("Failed to load Firebase configuration from backend.json: %s", e)
+            logger.warning("Push notifications will not work without proper Firebase configuration")
+            return None
+
 # Endpoints
 
 @app.get("/test-firebase")
 def test_firebase():
     """Test Firebase configuration"""
-    if not firebase_admin._apps:
+    if get_firebase_app() is None:
         return {
             "status": "error",
             "message": "Firebase not initialized",
@@ -684,68 +991,74 @@ def test_firebase():
             "configured": False
         }
 
-@app.get("/polls", response_model=List[Poll])
-def get_polls(db: Session = Depends(get_db)):
-    polls_db = db.query(PollDB).all()
+def load_polls(db: Session) -> List[Poll]:
+    polls_db = db.query(PollDB).options(*poll_load_options()).all()
     polls = []
     for p in polls_db:
         polls.append(db_to_poll(p, db))
     return polls
 
-# Trending polls (all-time): sorted by engagement (votes + comments)
-@app.get("/trending", response_model=List[Poll])
-def get_trending(db: Session = Depends(get_db)):
-    polls_db = db.query(PollDB).all()
-
-    # Precompute comment counts for each poll id efficiently
-    # (simple approach: count per poll; acceptable for moderate datasets)
-    engagement_list = []
-    for p in polls_db:
-        try:
-            total_votes = sum((opt.votes or 0) for opt in p.options)
-        except Exception:
-            total_votes = 0
-        try:
-            comments_count = db.query(CommentDB).filter(CommentDB.poll_id == p.id).count()
-        except Exception:
-            comments_count = 0
-        engagement = (total_votes or 0) + (comments_count or 0)
-        engagement_list.append((p, engagement))
-
-    # Sort by engagement desc, then by createdAt desc as tiebreaker
-    def sort_key(item):
-        poll, engagement = item
-        created = None
-        try:
-            created = poll.createdAt
-        except Exception:
-            created = None
-        return (engagement, created or datetime.min)
-
-    engagement_list.sort(key=sort_key, reverse=True)
+@app.get("/polls", response_model=List[Poll])
+async def get_polls():
+    return await cached_read("polls", polls_adapter, load_polls)
+
+def load_trending(db: Session) -> List[Poll]:
+    # Rank in SQL: engagement = total votes + comment count, each pre-aggregated once per poll,
+    # newest first as tiebreaker (served by the createdAt index)
+    vote_totals = select(PollOptionDB.poll_id, func.sum(PollOptionDB.votes).label("total"))\
+        .group_by(PollOptionDB.poll_id).subquery()
+    comment_counts = select(CommentDB.poll_id, func.count(CommentDB.id).label("total"))\
+        .group_by(CommentDB.poll_id).subquery()
+    engagement = func.coalesce(vote_totals.c.total, 0) + func.coalesce(comment_counts.c.total, 0)
+    polls_db = db.query(PollDB)\
+        .outerjoin(vote_totals, vote_totals.c.poll_id == PollDB.id)\
+        .outerjoin(comment_counts, comment_counts.c.poll_id == PollDB.id)\
+        .order_by(engagement.desc(), PollDB.createdAt.desc().nulls_last())\
+        .options(*poll_load_options())\
+        .all()
 
     # Return all polls sorted by engagement
-    return [db_to_poll(p, db) for (p, _) in engagement_list]
+    return [db_to_poll(p, db) for p in polls_db]
 
-@app.get("/polls/{poll_id}", response_model=Poll)
-def get_poll(poll_id: str, db: Session = Depends(get_db)):
-    poll_db = db.query(PollDB).filter(PollDB.id == poll_id).first()
+# Trending polls (all-time): sorted by engagement (votes + comments)
+@app.get("/trending", response_model=List[Poll])
+async def get_trending():
+    return await cached_read("trending", polls_adapter, load_trending)
+
+def load_poll(db: Session, poll_id: str) -> Poll:
+    poll_db = db.query(PollDB).options(*poll_load_options()).filter(PollDB.id == poll_id).first()
     if not poll_db:
         raise HTTPException(status_code=404, detail="Poll not found")
     return db_to_poll(poll_db, db)
 
+@app.get("/polls/{poll_id}", response_model=Poll)
+async def get_poll(poll_id: str):
+    return await cached_read(("poll", poll_id), poll_adapter, load_poll, poll_id)
+
 @app.post("/polls", response_model=Poll)
 def add_poll(poll: Poll, db: Session = Depends(get_db)):
-    poll_db = PollDB(id=poll.id, title=poll.title, description=poll.description, category=poll.category, thumbnail=poll.thumbnail, createdAt=date_parser.parse(poll.createdAt), disableVoiceComments=poll.disableVoiceComments)
+    poll_db = PollDB(id=poll.id, title=poll.title, description=poll.description, category=poll.category, thumbnail=poll.thumbnail, createdAt=parse_timestamp(poll.createdAt), disableVoiceComments=poll.disableVoiceComments)
     db.add(poll_db)
-    for opt in poll.options:
-        opt_db = PollOptionDB(id=opt.id, poll_id=poll.id, text=opt.text, imageUrl=opt.imageUrl, votes=opt.votes or 0, votedBy=json.dumps(opt.votedBy or []))
-        db.add(opt_db)
+    option_rows = [
+        {"id": opt.id, "poll_id": poll.id, "text": opt.text, "imageUrl": opt.imageUrl, "votes": opt.votes or 0}
+        for opt in poll.options
+    ]
+    vote_rows = [
+        {"user_id": uid, "option_id": opt.id, "poll_id": poll.id}
+        for opt in poll.options for uid in dict.fromkeys(opt.votedBy or [])
+    ]
     try:
+        db.flush()
+        # One multi-row INSERT per table instead of one INSERT per option/vote
+        if option_rows:
+            db.execute(insert(PollOptionDB), option_rows)
+        if vote_rows:
+            db.execute(insert(VoteDB), vote_rows)
         db.commit()
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to create poll: {e}")
+    invalidate_read_cache()
     # Return canonical representation from DB
     return db_to_poll(poll_db, db)
 
@@ -759,14 +1072,30 @@ def update_poll(poll_id: str, poll: Poll, db: Session = Depends(get_db)):
     poll_db.category = poll.category
     poll_db.thumbnail = poll.thumbnail
     poll_db.disableVoiceComments = poll.disableVoiceComments
-    for opt in poll.options:
-        opt_db = db.query(PollOptionDB).filter(PollOptionDB.id == opt.id).first()
-        if opt_db:
-            opt_db.text = opt.text
-            opt_db.imageUrl = opt.imageUrl
-            opt_db.votes = opt.votes
-            opt_db.votedBy = json.dumps(opt.votedBy)
+    # Only options that already exist are updated; fetch their ids in one query
+    option_ids = [opt.id for opt in poll.options]
+    existing_ids = set(db.scalars(select(PollOptionDB.id).where(PollOptionDB.id.in_(option_ids)))) if option_ids else set()
+    options = [opt for opt in poll.options if opt.id in existing_ids]
+    if options:
+        # Bulk UPDATE by primary key (executemany)
+        db.execute(
+            update(PollOptionDB),
+            [{"id": opt.id, "text": opt.text, "imageUrl": opt.imageUrl, "votes": opt.votes} for opt in options],
+        )
+        # Sync vote rows with the submitted voter lists, touching only what changed
+        submitted = {(uid, opt.id) for opt in options for uid in (opt.votedBy or [])}
+        current = set(db.execute(select(VoteDB.user_id, VoteDB.option_id).where(VoteDB.option_id.in_(existing_ids))).tuples())
+        stale = current - submitted
+        if stale:
+            db.execute(
+                delete(VoteDB).where(tuple_(VoteDB.user_id, VoteDB.option_id).in_(stale)),
+                execution_options={"synchronize_session": False},
+            )
+        added = submitted - current
+        if added:
+            db.execute(insert(VoteDB), [{"user_id": uid, "option_id": oid, "poll_id": poll_id} for uid, oid in added])
     db.commit()
+    invalidate_read_cache()
     return db_to_poll(poll_db, db)
 
 @app.delete("/polls/{poll_id}")
@@ -776,42 +1105,41 @@ def delete_poll(poll_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Poll not found")
     db.delete(poll_db)
     db.commit()
+    invalidate_read_cache()
     return {"message": "Poll deleted"}
 
-@app.post("/polls/{poll_id}/vote")
-def add_vote(poll_id: str, option_id: str = Query(...), user_id: str = Query(...), db: Session = Depends(get_db)):
+@app.post("/polls/{poll_id}/vote", response_model=Union[Poll, PollWriteAck])
+def add_vote(poll_id: str, option_id: str = Query(...), user_id: str = Query(...), compact: bool = Query(False), db: Session = Depends(get_db)):
     poll_db = db.query(PollDB).filter(PollDB.id == poll_id).first()
     if not poll_db:
         raise HTTPException(status_code=404, detail="Poll not found")
     opt_db = db.query(PollOptionDB).filter(PollOptionDB.id == option_id, PollOptionDB.poll_id == poll_id).first()
     if not opt_db:
         raise HTTPException(status_code=404, detail="Option not found")
-    votedBy = json.loads(opt_db.votedBy)
-    if user_id in votedBy:
+    # The (user_id, option_id) primary key turns a repeat vote into a no-op insert
+    inserted = db.execute(
+        upsert_insert(VoteDB).values(user_id=user_id, option_id=option_id, poll_id=poll_id).on_conflict_do_nothing()
+    ).rowcount
+    if not inserted:
+        if compact:
+            return PollWriteAck(pollId=poll_id, optionId=option_id, votes=opt_db.votes or 0)
         return db_to_poll(poll_db, db)
-    votedBy.append(user_id)
-    opt_db.votes += 1
-    opt_db.votedBy = json.dumps(votedBy)
-    # Increment user coins by 1 for this vote (with logging)
-    user_db = db.query(UserDB).filter(UserDB.id == user_id).first()
-    if user_db:
-        try:
-            before = int(user_db.coins or 0)
-            after = before + 1
-            user_db.coins = after
-            print(f"[coins] add_vote: user={user_id} before={before} after={after}")
-        except Exception as e:
-            # fallback to simple increment
-            try:
-                user_db.coins = (user_db.coins or 0) + 1
-                print(f"[coins] add_vote fallback increment for user={user_id}")
-            except Exception as e2:
-                print(f"[coins] add_vote failed for user={user_id}: {e} / {e2}")
+    # Bump the vote counter and the voter's coins in SQL so concurrent votes don't lose updates
+    votes = db.execute(
+        update(PollOptionDB).where(PollOptionDB.id == option_id).values(votes=func.coalesce(PollOptionDB.votes, 0) + 1).returning(PollOptionDB.votes),
+        execution_options={"synchronize_session": False},
+    ).scalar()
+    after = adjust_user_coins(db, user_id, 1)
+    if after is not None:
+        logger.info("[coins] add_vote: user=%s +1 after=%s", user_id, after)
     db.commit()
+    invalidate_read_cache()
+    if compact:
+        return PollWriteAck(pollId=poll_id, optionId=option_id, votes=votes, coins=after)
     return db_to_poll(poll_db, db)
 
-@app.post("/polls/{poll_id}/comments", response_model=Poll)
-def add_comment(poll_id: str, comment: Comment, db: Session = Depends(get_db)):
+@app.post("/polls/{poll_id}/comments", response_model=Union[Poll, PollWriteAck])
+def add_comment(poll_id: str, comment: Comment, compact: bool = Query(False), db: Session = Depends(get_db)):
     poll_db = db.query(PollDB).filter(PollDB.id == poll_id).first()
     if not poll_db:
         raise HTTPException(status_code=404, detail="Poll not found")
@@ -819,13 +1147,16 @@ def add_comment(poll_id: str, comment: Comment, db: Session = Depends(get_db)):
     if poll_db.disableVoiceComments:
         raise HTTPException(status_code=403, detail="Comments are disabled for this poll")
     
-    comment_db = CommentDB(id=comment.id, poll_id=poll_id, user_id=comment.user.id, text=comment.text, audio_url=comment.audio_url, timestamp=date_parser.parse(comment.timestamp), likes=comment.likes, likedBy="[]", flaggedForReview=comment.flaggedForReview, reviewReason=comment.reviewReason)
+    comment_db = CommentDB(id=comment.id, poll_id=poll_id, user_id=comment.user.id, text=comment.text, audio_url=comment.audio_url, timestamp=parse_timestamp(comment.timestamp), likes=comment.likes, flaggedForReview=comment.flaggedForReview, reviewReason=comment.reviewReason)
     db.add(comment_db)
     db.commit()
+    invalidate_read_cache()
+    if compact:
+        return PollWriteAck(pollId=poll_id, commentId=comment.id)
     return db_to_poll(poll_db, db)
 
-@app.post("/polls/{poll_id}/comments/{comment_id}/replies", response_model=Poll)
-def add_reply(poll_id: str, comment_id: str, reply: Comment, db: Session = Depends(get_db)):
+@app.post("/polls/{poll_id}/comments/{comment_id}/replies", response_model=Union[Poll, PollWriteAck])
+def add_reply(poll_id: str, comment_id: str, reply: Comment, compact: bool = Query(False), db: Session = Depends(get_db)):
     poll_db = db.query(PollDB).filter(PollDB.id == poll_id).first()
     if not poll_db:
         raise HTTPException(status_code=404, detail="Poll not found")
@@ -833,36 +1164,56 @@ def add_reply(poll_id: str, comment_id: str, reply: Comment, db: Session = Depen
     if poll_db.disableVoiceComments:
         raise HTTPException(status_code=403, detail="Comments are disabled for this poll")
     
-    reply_db = CommentDB(id=reply.id, poll_id=poll_id, user_id=reply.user.id, text=reply.text, audio_url=reply.audio_url, timestamp=date_parser.parse(reply.timestamp), likes=reply.likes, likedBy="[]", parent_id=comment_id, flaggedForReview=reply.flaggedForReview, reviewReason=reply.reviewReason)
+    reply_db = CommentDB(id=reply.id, poll_id=poll_id, user_id=reply.user.id, text=reply.text, audio_url=reply.audio_url, timestamp=parse_timestamp(reply.timestamp), likes=reply.likes, parent_id=comment_id, flaggedForReview=reply.flaggedForReview, reviewReason=reply.reviewReason)
     db.add(reply_db)
     db.commit()
+    invalidate_read_cache()
+    if compact:
+        return PollWriteAck(pollId=poll_id, commentId=reply.id)
     return db_to_poll(poll_db, db)
 
-@app.post("/polls/{poll_id}/comments/{comment_id}/like", response_model=Poll)
-def like_comment(poll_id: str, comment_id: str, user_id: str = Query(...), db: Session = Depends(get_db)):
+@app.post("/polls/{poll_id}/comments/{comment_id}/like", response_model=Union[Poll, PollWriteAck])
+def like_comment(poll_id: str, comment_id: str, user_id: str = Query(...), compact: bool = Query(False), db: Session = Depends(get_db)):
     comment_db = db.query(CommentDB).filter(CommentDB.id == comment_id).first()
     if not comment_db:
         raise HTTPException(status_code=404, detail="Comment not found")
-    likedBy = json.loads(comment_db.likedBy)
-    if user_id in likedBy:
+    unliked = db.query(CommentLikeDB).filter(CommentLikeDB.comment_id == comment_id, CommentLikeDB.user_id == user_id).delete(synchronize_session=False)
+    if unliked:
         # User already liked, so unlike (remove like)
-        likedBy.remove(user_id)
-        comment_db.likes -= 1
-        comment_db.likedBy = json.dumps(likedBy)
-        db.commit()
-        poll_db = db.query(PollDB).filter(PollDB.id == poll_id).first()
-        return db_to_poll(poll_db, db)
+        delta = -1
     else:
         # User hasn't liked yet, so add like
-        likedBy.append(user_id)
-        comment_db.likes += 1
-        comment_db.likedBy = json.dumps(likedBy)
+        db.add(CommentLikeDB(user_id=user_id, comment_id=comment_id))
+        delta = 1
+    likes = db.execute(
+        update(CommentDB).where(CommentDB.id == comment_id).values(likes=func.coalesce(CommentDB.likes, 0) + delta).returning(CommentDB.likes),
+        execution_options={"synchronize_session": False},
+    ).scalar()
+    try:
         db.commit()
-        poll_db = db.query(PollDB).filter(PollDB.id == poll_id).first()
-        return db_to_poll(poll_db, db)
+    except IntegrityError:
+        # A concurrent like from the same user won the race; keep that one
+        db.rollback()
+        likes = db.query(CommentDB.likes).filter(CommentDB.id == comment_id).scalar()
+    invalidate_read_cache()
+    if compact:
+        return PollWriteAck(pollId=poll_id, commentId=comment_id, likes=likes or 0)
+    poll_db = db.query(PollDB).filter(PollDB.id == poll_id).first()
+    return db_to_poll(poll_db, db)
+
+def comment_subtree_ids(*comment_ids: str):
+    """SELECT of the ids of the given comments and all their nested replies (recursive CTE)"""
+    subtree = select(CommentDB.id).where(CommentDB.id.in_(comment_ids)).cte("comment_subtree", recursive=True)
+    subtree = subtree.union_all(select(CommentDB.id).where(CommentDB.parent_id == subtree.c.id))
+    return select(subtree.c.id)
+
+def delete_comments(db: Session, comment_ids):
+    """Bulk-delete the comments selected by comment_ids along with their reports and likes"""
+    for model, column in ((ReportDB, ReportDB.comment_id), (CommentLikeDB, CommentLikeDB.comment_id), (CommentDB, CommentDB.id)):
+        db.execute(delete(model).where(column.in_(comment_ids)), execution_options={"synchronize_session": False})
 
-@app.delete("/polls/{poll_id}/comments/{comment_id}", response_model=Poll)
-def delete_comment(poll_id: str, comment_id: str, user_id: str = Query(...), db: Session = Depends(get_db)):
+@app.delete("/polls/{poll_id}/comments/{comment_id}", response_model=Union[Poll, PollWriteAck])
+def delete_comment(poll_id: str, comment_id: str, user_id: str = Query(...), compact: bool = Query(False), db: Session = Depends(get_db)):
     comment_db = db.query(CommentDB).filter(CommentDB.id == comment_id).first()
     if not comment_db:
         raise HTTPException(status_code=404, detail="Comment not found")
@@ -871,20 +1222,18 @@ def delete_comment(poll_id: str, comment_id: str, user_id: str = Query(...), db:
     if comment_db.user_id != user_id:
         raise HTTPException(status_code=403, detail="You can only delete your own comments")
     
-    def delete_replies(c_id):
-        replies = db.query(CommentDB).filter(CommentDB.parent_id == c_id).all()
-        for r in replies:
-            delete_replies(r.id)
-            db.delete(r)
-    delete_replies(comment_id)
-    db.delete(comment_db)
+    # Delete the comment, all nested replies and their reports/likes in one statement per table
+    delete_comments(db, comment_subtree_ids(comment_id))
     db.commit()
+    invalidate_read_cache()
+    if compact:
+        return PollWriteAck(pollId=poll_id, commentId=comment_id)
     poll_db = db.query(PollDB).filter(PollDB.id == poll_id).first()
     return db_to_poll(poll_db, db)
 
 @app.post("/reports", response_model=Report)
 def report_comment(report: Report, db: Session = Depends(get_db)):
-    report_db = ReportDB(id=report.id, pollId=report.pollId, comment_id=report.comment.id, reportedBy_id=report.reportedBy.id, timestamp=date_parser.parse(report.timestamp), status=report.status, reason=report.reason)
+    report_db = ReportDB(id=report.id, pollId=report.pollId, comment_id=report.comment.id, reportedBy_id=report.reportedBy.id, timestamp=parse_timestamp(report.timestamp), status=report.status, reason=report.reason)
     db.add(report_db)
     db.commit()
     return report
@@ -894,14 +1243,18 @@ def add_category(category: Category, db: Session = Depends(get_db)):
     category_db = CategoryDB(id=category.id, name=category.name)
     db.add(category_db)
     db.commit()
+    invalidate_read_cache()
     return category
 
-# List categories (used by admin UI)
-@app.get("/categories", response_model=List[Category])
-def list_categories(db: Session = Depends(get_db)):
+def load_categories(db: Session) -> List[Category]:
     rows = db.query(CategoryDB).all()
     return [Category(id=r.id, name=r.name) for r in rows]
 
+# List categories (used by admin UI)
+@app.get("/categories", response_model=List[Category])
+async def list_categories():
+    return await cached_read("categories", categories_adapter, load_categories)
+
 @app.delete("/categories/{category_id}")
 def delete_category(category_id: str, db: Session = Depends(get_db)):
     """Delete a category by ID and all polls within it"""
@@ -909,40 +1262,17 @@ def delete_category(category_id: str, db: Session = Depends(get_db)):
     if not category_db:
         raise HTTPException(status_code=404, detail="Category not found")
 
-    # Get all polls in this category
-    polls_to_delete = db.query(PollDB).filter(PollDB.category == category_id).all()
-
-    deleted_polls_count = 0
-    for poll_db in polls_to_delete:
-        # Delete all comments and their replies for this poll
-        def delete_comments_and_replies(poll_id):
-            comments = db.query(CommentDB).filter(CommentDB.poll_id == poll_id).all()
-            for comment in comments:
-                # Delete reports related to this comment
-                db.query(ReportDB).filter(ReportDB.comment_id == comment.id).delete()
-                # Delete replies recursively
-                def delete_replies(comment_id):
-                    replies = db.query(CommentDB).filter(CommentDB.parent_id == comment_id).all()
-                    for reply in replies:
-                        delete_replies(reply.id)
-                        db.delete(reply)
-                delete_replies(comment.id)
-                # Delete the comment itself
-                db.delete(comment)
-
-        # Delete all comments and replies for this poll
-        delete_comments_and_replies(poll_db.id)
-
-        # Delete all poll options for this poll
-        db.query(PollOptionDB).filter(PollOptionDB.poll_id == poll_db.id).delete()
-
-        # Delete the poll itself
-        db.delete(poll_db)
-        deleted_polls_count += 1
+    # Delete the polls in this category with their comments (replies share poll_id), votes and options
+    poll_ids = select(PollDB.id).where(PollDB.category == category_id)
+    delete_comments(db, select(CommentDB.id).where(CommentDB.poll_id.in_(poll_ids)))
+    db.execute(delete(VoteDB).where(VoteDB.poll_id.in_(poll_ids)), execution_options={"synchronize_session": False})
+    db.execute(delete(PollOptionDB).where(PollOptionDB.poll_id.in_(poll_ids)), execution_options={"synchronize_session": False})
+    deleted_polls_count = db.execute(delete(PollDB).where(PollDB.category == category_id), execution_options={"synchronize_session": False}).rowcount
 
     # Delete the category
     db.delete(category_db)
     db.commit()
+    invalidate_read_cache()
 
     return {
         "message": f"Category and {deleted_polls_count} poll(s) deleted successfully"
@@ -982,10 +1312,6 @@ def post_ads_reward(body: RewardBody, db: Session = Depends(get_db)):
     if not user_db:
         raise HTTPException(status_code=404, detail="User not found")
     date_str = today_ist_date_str()
-    try:
-        before = int(user_db.coins or 0)
-    except Exception:
-        before = 0
     # Always use configured ad reward amount from settings (default: 1)
     coins_setting = get_setting(db, "adRewardCoins", "1")
     try:
@@ -993,54 +1319,68 @@ def post_ads_reward(body: RewardBody, db: Session = Depends(get_db)):
     except Exception:
         grant = 1
     try:
-        # Update coins
-        user_db.coins = before + grant
-        # Upsert stats
-        row = db.query(AdsStatsDB).filter(AdsStatsDB.user_id == body.userId, AdsStatsDB.date == date_str).first()
-        if not row:
-            row = AdsStatsDB(user_id=body.userId, date=date_str, watched=1 if grant > 0 else 0, coins=grant)
-            db.add(row)
-        else:
-            row.watched = int(row.watched or 0) + (1 if grant > 0 else 0)
-            row.coins = int(row.coins or 0) + grant
+        # Update coins in SQL so concurrent rewards don't lose updates
+        after = adjust_user_coins(db, body.userId, grant)
+        # Upsert today's stats row in one statement (relies on unique ix_ads_user_date)
+        # A watch only counts when coins were granted; the conflict branch adds the same excluded value
+        stmt = upsert_insert(AdsStatsDB).values(user_id=body.userId, date=date_str, watched=1 if grant > 0 else 0, coins=grant)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["user_id", "date"],
+            set_={
+                "watched": func.coalesce(AdsStatsDB.watched, 0) + stmt.excluded.watched,
+                "coins": func.coalesce(AdsStatsDB.coins, 0) + stmt.excluded.coins,
+            },
+        ).returning(AdsStatsDB.watched, AdsStatsDB.coins)
+        stats = db.execute(stmt).one()
         db.commit()
-        print(f"[ads] reward: user={body.userId} +{grant} before={before} after={user_db.coins} date={date_str}")
+        logger.info("[ads] reward: user=%s +%s after=%s date=%s", body.userId, grant, after, date_str)
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to grant reward: {e}")
     # Return updated user and stats
-    row = db.query(AdsStatsDB).filter(AdsStatsDB.user_id == body.userId, AdsStatsDB.date == date_str).first()
-    return {"success": True, "user": db_to_user(user_db), "stats": {"userId": body.userId, "date": date_str, "watched": row.watched, "coins": row.coins}}
+    return {"success": True, "user": db_to_user(user_db), "stats": {"userId": body.userId, "date": date_str, "watched": stats.watched, "coins": stats.coins}}
 
 # =============================
 # Conversations (Inbox)
 # =============================
 
-@app.get("/conversations/{user_id}")
-def list_conversations(user_id: str, db: Session = Depends(get_db)):
-    msgs = db.query(MessageDB).filter(
+def load_conversations(db: Session, user_id: str) -> List[ConversationItem]:
+    # One round-trip: latest message per peer via ROW_NUMBER, joined to a grouped unread count
+    peer = case((MessageDB.sender_id == user_id, MessageDB.recipient_id), else_=MessageDB.sender_id).label("peer")
+    ranked = select(
+        peer,
+        MessageDB.createdAt.label("createdAt"),
+        func.row_number().over(partition_by=peer, order_by=MessageDB.createdAt.desc()).label("rn"),
+    ).where(
         (MessageDB.sender_id == user_id) | (MessageDB.recipient_id == user_id)
-    ).all()
-    peers: Dict[str, ConversationItem] = {}
-    for m in msgs:
-        peer = m.recipient_id if m.sender_id == user_id else m.sender_id
-        if peer not in peers:
-            peers[peer] = ConversationItem(peerId=peer, lastMessageAt="1970-01-01T00:00:00Z", unreadCount=0)
-        # update lastMessageAt
+    ).subquery()
+    unread = select(
+        MessageDB.sender_id.label("peer"),
+        func.count().label("unread"),
+    ).where(
+        MessageDB.recipient_id == user_id, MessageDB.readAt.is_(None)
+    ).group_by(MessageDB.sender_id).subquery()
+    stmt = select(
+        ranked.c.peer,
+        ranked.c.createdAt,
+        func.coalesce(unread.c.unread, 0),
+    ).outerjoin(unread, unread.c.peer == ranked.c.peer).where(ranked.c.rn == 1)
+
+    items: List[ConversationItem] = []
+    for peer_id, created_at, unread_count in db.execute(stmt).all():
         try:
-            created_iso = m.createdAt.astimezone(IST).isoformat()
+            created_iso = created_at.astimezone(IST).isoformat()
         except Exception:
-            created_iso = iso(m.createdAt) or "1970-01-01T00:00:00Z"
-        if created_iso > peers[peer].lastMessageAt:
-            peers[peer].lastMessageAt = created_iso
-        # unread count (only messages to user and not read)
-        if m.recipient_id == user_id and m.readAt is None:
-            peers[peer].unreadCount += 1
+            created_iso = iso(created_at) or "1970-01-01T00:00:00Z"
+        items.append(ConversationItem(peerId=peer_id, lastMessageAt=created_iso, unreadCount=unread_count))
     # sort by lastMessageAt desc
-    items = list(peers.values())
     items.sort(key=lambda x: x.lastMessageAt, reverse=True)
     return items
 
+@app.get("/conversations/{user_id}")
+async def list_conversations(user_id: str):
+    return await run_with_session(load_conversations, user_id)
+
 # =============================
 # Plaintext chat endpoints
 # =============================
@@ -1056,12 +1396,9 @@ class PlainSendBody(BaseModel):
 def send_plain_message(body: PlainSendBody, db: Session = Depends(get_db)):
     """Store a plaintext message by mapping text into MessageDB.ciphertext."""
     # Validate users exist (optional but safer)
-    if not db.query(UserDB).filter(UserDB.id == body.senderId).first():
-        raise HTTPException(status_code=404, detail="Sender not found")
-    if not db.query(UserDB).filter(UserDB.id == body.recipientId).first():
-        raise HTTPException(status_code=404, detail="Recipient not found")
+    ensure_message_users(db, body.senderId, body.recipientId)
     try:
-        created = date_parser.parse(body.createdAt)
+        created = parse_timestamp(body.createdAt)
     except Exception:
         created = datetime.now(IST)
     msg = MessageDB(
@@ -1088,7 +1425,7 @@ def get_thread_plain(userA: str = Query(...), userB: str = Query(...), after: Op
     )
     if after:
         try:
-            after_dt = date_parser.parse(after)
+            after_dt = parse_timestamp(after)
             q = q.filter(MessageDB.createdAt > after_dt)
         except Exception:
             pass
@@ -1112,10 +1449,16 @@ def get_thread_plain(userA: str = Query(...), userB: str = Query(...), after: Op
 
 @app.post("/messages/{message_id}/read")
 def mark_message_read(message_id: str, db: Session = Depends(get_db)):
-    m = db.query(MessageDB).filter(MessageDB.id == message_id).first()
-    if not m:
-        raise HTTPException(status_code=404, detail="Message not found")
-    m.readAt = datetime.now(IST)
+    # Stamp readAt only on the first read; an already-read message just needs the existence check
+    result = db.execute(
+        update(MessageDB)
+        .where(MessageDB.id == message_id, MessageDB.readAt.is_(None))
+        .values(readAt=datetime.now(IST)),
+        execution_options={"synchronize_session": False},
+    )
+    if result.rowcount == 0:
+        if db.execute(select(MessageDB.id).where(MessageDB.id == message_id)).first() is None:
+            raise HTTPException(status_code=404, detail="Message not found")
     db.commit()
     return {"success": True}
 
@@ -1123,31 +1466,58 @@ def mark_message_read(message_id: str, db: Session = Depends(get_db)):
 # Voice upload (kept the same contract)
 # =============================
 
-@app.post("/messages/voice")
-def upload_voice(
-    id: Optional[str] = Form(None),
-    senderId: str = Form(...),
-    recipientId: str = Form(...),
-    createdAt: Optional[str] = Form(None),
-    duration: Optional[float] = Form(0.0),
-    file: UploadFile = File(...),
-    db: Session = Depends(get_db),
-):
-    # Prepare filename and save under uploads/voice
-    msg_id = id or f"voice_{int(time.time()*1000)}"
-    filename = f"{msg_id}.webm"
-    folder = os.path.join("uploads", "voice")
-    os.makedirs(folder, exist_ok=True)
-    path = os.path.join(folder, filename)
+VOICE_MAX_BYTES = int(os.environ.get("VOICE_MAX_BYTES", str(10 * 1024 * 1024)))
+VOICE_COPY_CHUNK_BYTES = 1024 * 1024
+# Stored file extension by base MIME type (parameters such as ";codecs=opus" stripped); anything else is saved as .webm
+VOICE_EXTENSIONS = {
+    "audio/mp4": ".m4a",
+    "audio/m4a": ".m4a",
+    "audio/x-m4a": ".m4a",
+    "audio/mpeg": ".mp3",
+    "audio/mp3": ".mp3",
+    "audio/ogg": ".ogg",
+    "audio/opus": ".ogg",
+    "audio/webm": ".webm",
+}
+# Non-audio types recorders are known to send; other non-audio uploads are rejected
+VOICE_EXTRA_CONTENT_TYPES = {"", "application/octet-stream", "video/webm", "video/mp4"}
+VOICE_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]+")
+
+def check_voice_size(file: UploadFile) -> None:
+    """Reject oversize uploads before anything is written to disk or the DB."""
+    if file.size is not None and file.size > VOICE_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Voice message too large")
+
+def voice_extension(content_type: Optional[str]) -> str:
+    """Map the upload's content type to a file extension; 415 for types that can't be a voice note."""
+    ct = (content_type or "").split(";", 1)[0].strip().lower()
+    if not ct.startswith("audio/") and ct not in VOICE_EXTRA_CONTENT_TYPES:
+        raise HTTPException(status_code=415, detail="Unsupported voice message type")
+    return VOICE_EXTENSIONS.get(ct, ".webm")
+
+def voice_paths(msg_id: str, ext: str) -> tuple:
+    """Return (disk path, public URL) under uploads/voice/xx/yy/, sharded by a hash of the id to bound directory fan-out."""
+    filename = f"{msg_id}{ext}"
+    shard = hashlib.blake2b(msg_id.encode(), digest_size=2).hexdigest()
+    rel_dir = f"voice/{shard[:2]}/{shard[2:]}"
+    return os.path.join("uploads", rel_dir, filename), f"/uploads/{rel_dir}/{filename}"
+
+def write_voice_file(src, path: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
     with open(path, "wb") as f:
-        f.write(file.file.read())
+        shutil.copyfileobj(src, f, length=VOICE_COPY_CHUNK_BYTES)
+
+def check_voice_message(db: Session, msg_id: str, senderId: str, recipientId: str) -> None:
+    """Read-only checks run while the upload streams to disk: both users exist and the id is free."""
+    ensure_message_users(db, senderId, recipientId)
+    if db.execute(select(MessageDB.id).where(MessageDB.id == msg_id)).first() is not None:
+        raise HTTPException(status_code=409, detail="Message already exists")
 
-    # Create message row
+def insert_voice_message(db: Session, msg_id: str, senderId: str, recipientId: str, createdAt: Optional[str], duration: Optional[float], audio_url: str) -> None:
     try:
-        created = date_parser.parse(createdAt) if createdAt else datetime.now(IST)
+        created = parse_timestamp(createdAt) if createdAt else datetime.now(IST)
     except Exception:
         created = datetime.now(IST)
-    rel_url = f"/uploads/voice/{filename}"
     m = MessageDB(
         id=msg_id,
         sender_id=senderId,
@@ -1157,12 +1527,71 @@ def upload_voice(
         createdAt=created,
         delivered=True,
         readAt=None,
-        audioUrl=rel_url,
+        audioUrl=audio_url,
         audioDuration=float(duration or 0.0),
     )
     db.add(m)
-    db.commit()
-    return {"success": True, "audioUrl": rel_url, "audioDuration": float(duration or 0.0)}
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Message already exists")
+
+def publish_voice_file(tmp_path: str, path: str) -> None:
+    """Move the finished upload into the served folder without replacing an existing file (409 if taken)."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        os.link(tmp_path, path)
+    except FileExistsError:
+        raise HTTPException(status_code=409, detail="Message already exists")
+    finally:
+        discard_file(tmp_path)
+
+def discard_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+@app.post("/messages/voice")
+async def upload_voice(
+    id: Optional[str] = Form(None),
+    senderId: str = Form(...),
+    recipientId: str = Form(...),
+    createdAt: Optional[str] = Form(None),
+    duration: Optional[float] = Form(0.0),
+    file: UploadFile = File(...),
+):
+    # The id becomes the file name, so only allow characters that can't escape the upload folder
+    if id is not None and not VOICE_ID_PATTERN.fullmatch(id):
+        raise HTTPException(status_code=400, detail="Invalid message id")
+    check_voice_size(file)
+    ext = voice_extension(file.content_type)
+    msg_id = id or f"voice_{int(time.time()*1000)}"
+    path, audio_url = voice_paths(msg_id, ext)
+
+    # Stream the upload to a temp file outside the static mount while the read-only user/id checks run, both in
+    # the threadpool, so the request waits for the slower of the two rather than both. The file is then published
+    # (never replacing an existing one) and only after that is the row inserted and committed in a short
+    # transaction, so no write lock is held across disk I/O and readers never see an audioUrl that isn't there yet.
+    tmp_path = os.path.join("uploads_tmp", "voice", f"{msg_id}{ext}.{secrets.token_hex(4)}.part")
+    write_result, check_result = await asyncio.gather(
+        run_in_threadpool(write_voice_file, file.file, tmp_path),
+        run_with_session(check_voice_message, msg_id, senderId, recipientId),
+        return_exceptions=True,
+    )
+    for result in (check_result, write_result):
+        if isinstance(result, BaseException):
+            await run_in_threadpool(discard_file, tmp_path)
+            raise result
+    await run_in_threadpool(publish_voice_file, tmp_path, path)
+    try:
+        await run_with_session(insert_voice_message, msg_id, senderId, recipientId, createdAt, duration, audio_url)
+    except BaseException:
+        # The published file is ours (publishing never replaces one), so it can go with the failed row
+        await run_in_threadpool(discard_file, path)
+        raise
+    return {"success": True, "audioUrl": audio_url, "audioDuration": float(duration or 0.0)}
 
 @app.get("/users/{user_id}", response_model=User)
 def get_user(user_id: str, db: Session = Depends(get_db)):
@@ -1171,24 +1600,37 @@ def get_user(user_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="User not found")
     return db_to_user(user_db)
 
-@app.get("/users", response_model=List[User])
-def get_users(db: Session = Depends(get_db)):
+def load_users(db: Session) -> List[User]:
     users_db = db.query(UserDB).all()
     return [db_to_user(u) for u in users_db]
 
+@app.get("/users", response_model=List[User])
+async def get_users():
+    return await run_with_session(load_users)
+
 # Settings helpers
+# Settings are read on every reward/referral but rarely change: cache per key.
+# set_setting invalidates locally; the TTL bounds staleness on other workers.
+SETTINGS_CACHE_TTL_SECONDS = 60
+settings_cache = TTLCache(maxsize=64, ttl=SETTINGS_CACHE_TTL_SECONDS)
+settings_cache_lock = threading.Lock()
+SETTING_NOT_CACHED = object()
+
 def get_setting(db: Session, key: str, default: str | None = None) -> Optional[str]:
-    s = db.query(SettingsDB).filter(SettingsDB.key == key).first()
-    return s.value if s else default
+    with settings_cache_lock:
+        row = settings_cache.get(key, SETTING_NOT_CACHED)
+    if row is SETTING_NOT_CACHED:
+        row = db.query(SettingsDB.value).filter(SettingsDB.key == key).first()
+        with settings_cache_lock:
+            settings_cache[key] = row
+    return row.value if row else default
 
 def set_setting(db: Session, key: str, value: str) -> None:
-    s = db.query(SettingsDB).filter(SettingsDB.key == key).first()
-    if s:
-        s.value = value
-    else:
-        s = SettingsDB(key=key, value=value)
-        db.add(s)
+    stmt = upsert_insert(SettingsDB).values(key=key, value=value)
+    db.execute(stmt.on_conflict_do_update(index_elements=["key"], set_={"value": stmt.excluded.value}))
     db.commit()
+    with settings_cache_lock:
+        settings_cache.pop(key, None)
 
 @app.get("/settings/coin-value")
 def get_coin_value(db: Session = Depends(get_db)):
@@ -1246,6 +1688,9 @@ def put_ad_reward(body: AdRewardBody, db: Session = Depends(get_db)):
 # =============================
 
 PRESENCE_TTL_SECONDS = 300
+PRESENCE_TTL = timedelta(seconds=PRESENCE_TTL_SECONDS)
+# Heartbeats only rewrite lastSeen once it is older than this; well under the TTL, so online status is unaffected
+PRESENCE_WRITE_INTERVAL = timedelta(seconds=60)
 
 @app.post("/presence/ping")
 def presence_ping(
@@ -1254,29 +1699,43 @@ def presence_ping(
     db: Session = Depends(get_db)
 ):
     """Mark a user as online by updating lastSeen (IST, timezone-aware).
+    lastSeen is only rewritten once the stored value is older than PRESENCE_WRITE_INTERVAL, so pings in between
+    change no rows; the check is on stored state, so every worker agrees (an offline backdate is always stale).
     Accepts either query param ?user_id=... or JSON body { "userId": "..." } for flexibility.
     """
     uid = user_id or (body.get("userId") if isinstance(body, dict) else None)
     if not uid:
         raise HTTPException(status_code=400, detail="user_id is required")
-    user = db.query(UserDB).filter(UserDB.id == uid).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    user.lastSeen = datetime.now(IST)
+    now = datetime.now(IST)
+    result = db.execute(
+        update(UserDB)
+        .where(UserDB.id == uid, or_(UserDB.lastSeen.is_(None), UserDB.lastSeen < now - PRESENCE_WRITE_INTERVAL))
+        .values(lastSeen=now)
+        .returning(UserDB.lastSeen),
+        execution_options={"synchronize_session": False},
+    )
+    stored = result.first()
+    if stored is None:
+        # Fresh lastSeen (nothing to write) or unknown user; report the value actually stored
+        stored = db.execute(select(UserDB.id, UserDB.lastSeen).where(UserDB.id == uid)).first()
+        if stored is None:
+            raise HTTPException(status_code=404, detail="User not found")
     db.commit()
+    # Report what reading back the naive column gives, as before
+    last_seen = stored.lastSeen
     try:
-        last_seen_iso = user.lastSeen.astimezone(IST).isoformat()
+        last_seen_iso = last_seen.astimezone(IST).isoformat()
     except Exception:
-        last_seen_iso = user.lastSeen.isoformat()
+        last_seen_iso = last_seen.isoformat()
     return {"ok": True, "userId": uid, "lastSeen": last_seen_iso}
 
-@app.get("/presence/{user_id}")
-def presence_status(user_id: str, db: Session = Depends(get_db)):
+def load_presence(db: Session, user_id: str) -> Dict[str, Any]:
     """Return online flag based on lastSeen within TTL; provide lastSeen ISO string."""
-    user = db.query(UserDB).filter(UserDB.id == user_id).first()
-    if not user:
+    # Only lastSeen is needed; skip hydrating the whole user row
+    row = db.query(UserDB.lastSeen).filter(UserDB.id == user_id).first()
+    if not row:
         raise HTTPException(status_code=404, detail="User not found")
-    last = user.lastSeen
+    last = row.lastSeen
     online = False
     last_seen_iso = None
     if last is not None:
@@ -1289,7 +1748,7 @@ def presence_status(user_id: str, db: Session = Depends(get_db)):
             pass
         now = datetime.now(IST)
         try:
-            online = (now - last) <= timedelta(seconds=PRESENCE_TTL_SECONDS)
+            online = (now - last) <= PRESENCE_TTL
         except Exception:
             online = False
         try:
@@ -1298,6 +1757,10 @@ def presence_status(user_id: str, db: Session = Depends(get_db)):
             last_seen_iso = last.isoformat()
     return {"userId": user_id, "online": online, "lastSeen": last_seen_iso}
 
+@app.get("/presence/{user_id}")
+async def presence_status(user_id: str):
+    return await run_with_session(load_presence, user_id)
+
 @app.post("/presence/offline")
 def presence_offline(
     user_id: Optional[str] = Query(None),
@@ -1314,7 +1777,7 @@ def presence_offline(
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     # Backdate beyond TTL to ensure presence reads as offline immediately
-    user.lastSeen = datetime.now(IST) - timedelta(seconds=PRESENCE_TTL_SECONDS * 2)
+    user.lastSeen = datetime.now(IST) - 2 * PRESENCE_TTL
     db.commit()
     try:
         last_seen_iso = user.lastSeen.astimezone(IST).isoformat()
@@ -1324,75 +1787,89 @@ def presence_offline(
 
 @app.post("/referral/apply")
 def apply_referral(body: ApplyReferralBody, db: Session = Depends(get_db)):
-    joiner = db.query(UserDB).filter(UserDB.id == body.joinerUserId).first()
-    if not joiner:
-        raise HTTPException(status_code=404, detail="Joiner user not found")
-    if joiner.referredBy:
-        raise HTTPException(status_code=400, detail="Referral already applied for this user")
     # Find referrer by referral code
     referrer = db.query(UserDB).filter(UserDB.referralCode == body.referralCode).first()
     if not referrer:
+        if not db.query(UserDB.id).filter(UserDB.id == body.joinerUserId).first():
+            raise HTTPException(status_code=404, detail="Joiner user not found")
         raise HTTPException(status_code=404, detail="Invalid referral code")
-    if referrer.id == joiner.id:
-        raise HTTPException(status_code=400, detail="Cannot refer yourself")
 
     # Read rewards
     rewards = get_referral_rewards(db)
     referrer_reward = rewards["referrerCoins"]
     referee_reward = rewards["refereeCoins"]
 
-    # Apply atomically
+    # Apply atomically: the guarded UPDATE both checks and claims the referral, so a
+    # concurrent second apply for the same joiner matches no row
     try:
-        try:
-            before_joiner = int(joiner.coins or 0)
-        except Exception:
-            before_joiner = 0
-        try:
-            before_referrer = int(referrer.coins or 0)
-        except Exception:
-            before_referrer = 0
-
-        joiner.coins = int(joiner.coins or 0) + int(referee_reward)
-        joiner.referredBy = referrer.id
-        referrer.coins = int(referrer.coins or 0) + int(referrer_reward)
+        joiner = db.scalars(
+            update(UserDB)
+            .where(
+                UserDB.id == body.joinerUserId,
+                UserDB.id != referrer.id,
+                or_(UserDB.referredBy.is_(None), UserDB.referredBy == ""),
+            )
+            .values(referredBy=referrer.id, coins=func.coalesce(UserDB.coins, 0) + int(referee_reward))
+            .returning(UserDB),
+            execution_options={"synchronize_session": False},
+        ).first()
+        if joiner is None:
+            db.rollback()
+            existing = db.query(UserDB.id, UserDB.referredBy).filter(UserDB.id == body.joinerUserId).first()
+            if not existing:
+                raise HTTPException(status_code=404, detail="Joiner user not found")
+            if existing.referredBy:
+                raise HTTPException(status_code=400, detail="Referral already applied for this user")
+            raise HTTPException(status_code=400, detail="Cannot refer yourself")
+        referrer = db.scalars(
+            update(UserDB)
+            .where(UserDB.id == referrer.id)
+            .values(coins=func.coalesce(UserDB.coins, 0) + int(referrer_reward))
+            .returning(UserDB),
+            execution_options={"synchronize_session": False, "populate_existing": True},
+        ).one()
+        result = {
+            "success": True,
+            "referrer": db_to_user(referrer),
+            "referee": db_to_user(joiner)
+        }
         db.commit()
-
-        after_joiner = int(joiner.coins or 0)
-        after_referrer = int(referrer.coins or 0)
-        print(f"[coins] apply_referral: joiner={joiner.id} before={before_joiner} after={after_joiner}; referrer={referrer.id} before={before_referrer} after={after_referrer}")
+        logger.info("[coins] apply_referral: joiner=%s +%s after=%s; referrer=%s +%s after=%s", joiner.id, referee_reward, joiner.coins, referrer.id, referrer_reward, referrer.coins)
+    except HTTPException:
+        raise
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to apply referral: {e}")
 
-    return {
-        "success": True,
-        "referrer": db_to_user(referrer),
-        "referee": db_to_user(joiner)
-    }
+    return result
 
 @app.post("/login")
 def login(request: LoginRequest, db: Session = Depends(get_db)):
-    print(f"[LOGIN] Login attempt for email: {request.email}")
+    logger.info("[LOGIN] Login attempt for email: %s", request.email)
     
-    # Validate email and password
-    user_db = db.query(UserDB).filter(UserDB.email == request.email, UserDB.password == request.password).first()
-    if not user_db:
-        print(f"[LOGIN] Invalid credentials for: {request.email}")
+    # Look up by email alone (unique index), then check the password hash in Python
+    user_db = db.query(UserDB).filter(UserDB.email == request.email).first()
+    if not user_db or not verify_password(request.password, user_db.password):
+        logger.warning("[LOGIN] Invalid credentials for: %s", request.email)
         return {"success": False, "message": "Invalid email or password"}
+    if not is_password_hash(user_db.password):
+        # Legacy plaintext row: upgrade it now that the password is known
+        user_db.password = hash_password(request.password)
+        db.commit()
     
     if user_db.isBanned:
-        print(f"[LOGIN] Banned user attempted login: {request.email}")
+        logger.warning("[LOGIN] Banned user attempted login: %s", request.email)
         return {"success": False, "message": "This account has been banned."}
     
-    print(f"[LOGIN] User found: {user_db.email}, isAdmin: {user_db.isAdmin}")
+    logger.info("[LOGIN] User found: %s, isAdmin: %s", user_db.email, user_db.isAdmin)
     
     # Admin users login directly without OTP
     if user_db.isAdmin:
-        print(f"[LOGIN] Admin login successful: {user_db.email}")
+        logger.info("[LOGIN] Admin login successful: %s", user_db.email)
         return {"success": True, "user": db_to_user(user_db), "requiresOTP": False}
     
     # For non-admin users, generate and send OTP
-    print(f"[LOGIN] Generating OTP for non-admin user: {user_db.email}")
+    logger.info("[LOGIN] Generating OTP for non-admin user: %s", user_db.email)
     otp_code = generate_otp()
     
     # Use UTC for consistent timezone handling across database
@@ -1408,17 +1885,17 @@ def login(request: LoginRequest, db: Session = Depends(get_db)):
     )
     db.add(otp_db)
     db.commit()
-    print(f"[LOGIN] OTP stored in database for: {user_db.email}")
-    print(f"[LOGIN] OTP expires at: {expires_at} (UTC), valid for {OTP_EXPIRY_MINUTES} minutes")
+    logger.info("[LOGIN] OTP stored in database for: %s", user_db.email)
+    logger.info("[LOGIN] OTP expires at: %s (UTC), valid for %s minutes", expires_at, OTP_EXPIRY_MINUTES)
     
     # Send OTP via email
     email_sent = send_otp_email(user_db.email, otp_code)
     
     if email_sent:
-        print(f"[LOGIN] OTP email sent successfully to: {user_db.email}")
+        logger.info("[LOGIN] OTP email sent successfully to: %s", user_db.email)
     else:
-        print(f"[LOGIN] OTP generated but email not sent (check SMTP config): {otp_code}")
-        print(f"[LOGIN] SMTP Config - Server: {SMTP_SERVER}, Port: {SMTP_PORT}, Username: {SMTP_USERNAME}")
+        logger.warning("[LOGIN] OTP generated but email not sent (check SMTP config): %s", otp_code)
+        logger.warning("[LOGIN] SMTP Config - Server: %s, Port: %s, Username: %s", SMTP_SERVER, SMTP_PORT, SMTP_USERNAME)
     
     return {
         "success": True, 
@@ -1432,7 +1909,7 @@ def login(request: LoginRequest, db: Session = Depends(get_db)):
 @app.post("/verify-otp")
 def verify_otp(request: VerifyOTPRequest, db: Session = Depends(get_db)):
     """Verify OTP and complete login for non-admin users"""
-    print(f"[VERIFY-OTP] Verifying OTP for: {request.email}")
+    logger.info("[VERIFY-OTP] Verifying OTP for: %s", request.email)
     
     # Find the most recent unused OTP for this email
     otp_db = db.query(OTPDB).filter(
@@ -1442,7 +1919,7 @@ def verify_otp(request: VerifyOTPRequest, db: Session = Depends(get_db)):
     ).order_by(OTPDB.created_at.desc()).first()
     
     if not otp_db:
-        print(f"[VERIFY-OTP] Invalid OTP for: {request.email}")
+        logger.warning("[VERIFY-OTP] Invalid OTP for: %s", request.email)
         return {"success": False, "message": "Invalid OTP"}
     
     # Check if OTP has expired - use UTC consistently
@@ -1455,30 +1932,30 @@ def verify_otp(request: VerifyOTPRequest, db: Session = Depends(get_db)):
         expires_at = pytz.UTC.localize(expires_at)
     
     # Debug logging
-    print(f"[VERIFY-OTP] Current time (UTC): {now_utc}")
-    print(f"[VERIFY-OTP] OTP expires at (UTC): {expires_at}")
-    print(f"[VERIFY-OTP] Time difference: {(expires_at - now_utc).total_seconds()} seconds")
+    logger.info("[VERIFY-OTP] Current time (UTC): %s", now_utc)
+    logger.info("[VERIFY-OTP] OTP expires at (UTC): %s", expires_at)
+    logger.info("[VERIFY-OTP] Time difference: %s seconds", (expires_at - now_utc).total_seconds())
     
     if now_utc > expires_at:
-        print(f"[VERIFY-OTP] ✗ Expired OTP for: {request.email}")
+        logger.warning("[VERIFY-OTP] ✗ Expired OTP for: %s", request.email)
         return {"success": False, "message": "OTP has expired. Please request a new one."}
     
     # Mark OTP as used
     otp_db.is_used = True
     db.commit()
-    print(f"[VERIFY-OTP] OTP marked as used for: {request.email}")
+    logger.info("[VERIFY-OTP] OTP marked as used for: %s", request.email)
     
     # Get user and return user data
     user_db = db.query(UserDB).filter(UserDB.email == request.email).first()
     if not user_db:
-        print(f"[VERIFY-OTP] User not found: {request.email}")
+        logger.warning("[VERIFY-OTP] User not found: %s", request.email)
         return {"success": False, "message": "User not found"}
     
     if user_db.isBanned:
-        print(f"[VERIFY-OTP] Banned user attempted verification: {request.email}")
+        logger.warning("[VERIFY-OTP] Banned user attempted verification: %s", request.email)
         return {"success": False, "message": "This account has been banned."}
     
-    print(f"[VERIFY-OTP] ✓ OTP verified successfully for: {request.email}")
+    logger.info("[VERIFY-OTP] ✓ OTP verified successfully for: %s", request.email)
     return {"success": True, "user": db_to_user(user_db)}
 
 @app.post("/resend-otp")
@@ -1509,13 +1986,13 @@ def resend_otp(request: dict, db: Session = Depends(get_db)):
     )
     db.add(otp_db)
     db.commit()
-    print(f"[RESEND-OTP] New OTP generated for: {email}, expires at: {expires_at} (UTC)")
+    logger.info("[RESEND-OTP] New OTP generated for: %s, expires at: %s (UTC)", email, expires_at)
     
     # Send OTP via email
     email_sent = send_otp_email(email, otp_code)
     
     if not email_sent:
-        print(f"[RESEND OTP] OTP generated but email not sent: {otp_code}")
+        logger.warning("[RESEND OTP] OTP generated but email not sent: %s", otp_code)
     
     return {
         "success": True,
@@ -1536,12 +2013,12 @@ def signup(user: User, db: Session = Depends(get_db)):
         id=user.id,
         name=user.name,
         email=user.email,
-        password=user.password,
+        password=hash_password(user.password),
         avatar=user.avatar,
         isAdmin=False,  # Always False for new signups
         coins=user.coins,
         dailyAttempts=user.dailyAttempts,
-        lastAttemptDate=date_parser.parse(user.lastAttemptDate),
+        lastAttemptDate=parse_timestamp(user.lastAttemptDate),
         isBanned=False,  # Always False for new signups
         mobile=user.mobile,
         gender=user.gender,
@@ -1553,39 +2030,29 @@ def signup(user: User, db: Session = Depends(get_db)):
     )
     db.add(user_db)
     db.commit()
-    print(f"[SIGNUP] New user created: {user.email} (isAdmin=False)")
+    logger.info("[SIGNUP] New user created: %s (isAdmin=False)", user.email)
     return db_to_user(user_db)
 
 @app.post("/users/{user_id}/coins/increment")
 def increment_user_coins(user_id: str, amount: int = Query(1, ge=1), db: Session = Depends(get_db)):
-    user_db = db.query(UserDB).filter(UserDB.id == user_id).first()
-    if not user_db:
+    after = adjust_user_coins(db, user_id, int(amount))
+    if after is None:
         raise HTTPException(status_code=404, detail="User not found")
-    try:
-        before = int(user_db.coins or 0)
-    except Exception:
-        before = 0
-    after = before + int(amount)
-    user_db.coins = after
     db.commit()
-    print(f"[coins] increment: user={user_id} +{amount} before={before} after={after}")
+    logger.info("[coins] increment: user=%s +%s after=%s", user_id, amount, after)
     return {"success": True, "coins": after}
 
 @app.post("/users/{user_id}/coins/decrement")
 def decrement_user_coins(user_id: str, amount: int = Query(1, ge=1), db: Session = Depends(get_db)):
-    user_db = db.query(UserDB).filter(UserDB.id == user_id).first()
-    if not user_db:
-        raise HTTPException(status_code=404, detail="User not found")
-    try:
-        before = int(user_db.coins or 0)
-    except Exception:
-        before = 0
-    if before < amount:
-        raise HTTPException(status_code=400, detail=f"Insufficient coins. Current: {before}, required: {amount}")
-    after = before - int(amount)
-    user_db.coins = after
+    # Balance check and deduction in one statement, so concurrent spends can't overdraw
+    after = adjust_user_coins(db, user_id, -int(amount), require_balance=True)
+    if after is None:
+        row = db.query(UserDB.coins).filter(UserDB.id == user_id).first()
+        if not row:
+            raise HTTPException(status_code=404, detail="User not found")
+        raise HTTPException(status_code=400, detail=f"Insufficient coins. Current: {row.coins or 0}, required: {amount}")
     db.commit()
-    print(f"[coins] decrement: user={user_id} -{amount} before={before} after={after}")
+    logger.info("[coins] decrement: user=%s -%s after=%s", user_id, amount, after)
     return {"success": True, "coins": after}
 
 @app.post("/forgot-password")
@@ -1604,13 +2071,15 @@ def update_user(user_id: str, user: User, db: Session = Depends(get_db)):
 
     user_db.name = user.name
     user_db.email = user.email
-    user_db.password = user.password
+    # Responses blank the password, so an empty (or echoed stored) value means unchanged; anything else is hashed
+    if user.password and user.password != user_db.password:
+        user_db.password = hash_password(user.password)
     user_db.avatar = user.avatar
     user_db.isAdmin = user.isAdmin
     # Allow coins update (typically for admin panel)
     user_db.coins = user.coins
     user_db.dailyAttempts = user.dailyAttempts
-    user_db.lastAttemptDate = date_parser.parse(user.lastAttemptDate)
+    user_db.lastAttemptDate = parse_timestamp(user.lastAttemptDate)
     user_db.isBanned = user.isBanned
     user_db.mobile = user.mobile
     user_db.gender = user.gender
@@ -1624,9 +2093,11 @@ def update_user(user_id: str, user: User, db: Session = Depends(get_db)):
     except Exception:
         after_coins = 0
     if before_coins != after_coins:
-        print(f"[coins] update_user: user={user_id} before={before_coins} after={after_coins}")
+        logger.info("[coins] update_user: user=%s before=%s after=%s", user_id, before_coins, after_coins)
 
     db.commit()
+    # Comment authors' names/avatars are embedded in cached polls
+    invalidate_read_cache()
     return db_to_user(user_db)
 
 @app.delete("/users/{user_id}")
@@ -1636,6 +2107,7 @@ def delete_user(user_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="User not found")
     db.delete(user_db)
     db.commit()
+    invalidate_read_cache()
     return {"message": "User deleted"}
 
 @app.get("/users/{user_id}/coins")
@@ -1698,13 +2170,14 @@ def send_notification(notif: Notification, db: Session = Depends(get_db)):
 
 @app.post("/notifications/mark-read")
 def mark_all_notifications_as_read(db: Session = Depends(get_db)):
-    db.query(NotificationDB).update({"read": True})
+    # Only touch unread rows; nothing in the session needs syncing for a blanket flag update
+    db.query(NotificationDB).filter(NotificationDB.read.isnot(True)).update({"read": True}, synchronize_session=False)
     db.commit()
     return {"message": "All notifications marked as read"}
 
 @app.put("/reports/{report_id}", response_model=Report)
 def resolve_report(report_id: str, db: Session = Depends(get_db)):
-    report_db = db.query(ReportDB).options(selectinload(ReportDB.comment).selectinload(CommentDB.user), selectinload(ReportDB.reportedBy)).filter(ReportDB.id == report_id).first()
+    report_db = db.query(ReportDB).options(joinedload(ReportDB.comment).joinedload(CommentDB.user), joinedload(ReportDB.reportedBy)).filter(ReportDB.id == report_id).first()
     if not report_db:
         raise HTTPException(status_code=404, detail="Report not found")
     if report_db.comment is None or report_db.reportedBy is None:
@@ -1726,16 +2199,18 @@ def delete_report(report_id: str, db: Session = Depends(get_db)):
 
 @app.get("/reports", response_model=List[Report])
 def get_reports(db: Session = Depends(get_db)):
-    reports_db = db.query(ReportDB).options(selectinload(ReportDB.comment).selectinload(CommentDB.user), selectinload(ReportDB.reportedBy)).all()
+    reports_db = db.query(ReportDB).options(joinedload(ReportDB.comment).joinedload(CommentDB.user), joinedload(ReportDB.reportedBy)).all()
     reports = []
+    # Replies under every reported comment in one recursive query
+    children = load_reply_tree(db, [r.comment.id for r in reports_db if r.comment is not None])
     for r in reports_db:
         if r.comment is None or r.reportedBy is None:
             # Skip reports with missing relationships
             continue
-        comment = db_to_comment(r.comment, db)
+        comment = db_to_comment(r.comment, db, children)
         reportedBy = CommentUser(id=r.reportedBy.id, name=r.reportedBy.name, email=r.reportedBy.email, avatar=r.reportedBy.avatar)
         reports.append(Report(id=r.id, pollId=r.pollId, comment=comment, reportedBy=reportedBy, timestamp=r.timestamp.isoformat(), status=r.status, reason=r.reason))
-    return reports
+    return json_response(reports_adapter, reports)
 
 def get_allowed_redemption_amount(successful_redemptions: int) -> int:
     """
@@ -1769,28 +2244,34 @@ def get_user_allowed_redemption(user_id: str, db: Session = Depends(get_db)):
 @app.post("/redemption-requests", response_model=RedemptionRequest)
 def add_redemption_request(request: RedemptionRequest, db: Session = Depends(get_db)):
     # Create redemption request
-    request_db = RedemptionRequestDB(id=request.id, user_id=request.user.id, amount=request.amount, paymentDetails=request.paymentDetails, status=request.status, requestedAt=date_parser.parse(request.requestedAt), updatedAt=date_parser.parse(request.updatedAt) if request.updatedAt else None, adminNotes=request.adminNotes)
-    db.add(request_db)
+    # RETURNING gives back the timestamps exactly as the columns stored them (dialect/session-TZ conversions included)
+    stored = db.execute(
+        insert(RedemptionRequestDB).values(id=request.id, user_id=request.user.id, amount=request.amount, paymentDetails=request.paymentDetails, status=request.status, requestedAt=parse_timestamp(request.requestedAt), updatedAt=parse_timestamp(request.updatedAt) if request.updatedAt else None, adminNotes=request.adminNotes)
+        .returning(RedemptionRequestDB.requestedAt, RedemptionRequestDB.updatedAt)
+    ).one()
     
     # Do not increment successfulRedemptions count when redemption request is created
     # It should only be incremented when the redemption is approved
     user_db = db.query(UserDB).filter(UserDB.id == request.user.id).first()
-    print(f"[redemption] Created redemption request for user {request.user.id}. Current successful redemptions count: {user_db.successfulRedemptions if user_db else 0}")
+    logger.info("[redemption] Created redemption request for user %s. Current successful redemptions count: %s", request.user.id, user_db.successfulRedemptions if user_db else 0)
+    
+    # Build the response from the rows already in hand instead of re-querying after commit
+    # (formatted like GET /redemption-requests formats the stored values)
+    requested_at = stored.requestedAt.isoformat()
+    updated_at = stored.updatedAt.isoformat() if stored.updatedAt else None
+    user = CommentUser(id=user_db.id, name=user_db.name, email=user_db.email, avatar=user_db.avatar) if user_db else None
     
     db.commit()
     
-    # Reload the request with user relationship
-    request_db = db.query(RedemptionRequestDB).options(selectinload(RedemptionRequestDB.user)).filter(RedemptionRequestDB.id == request.id).first()
-    if request_db and request_db.user:
-        user = CommentUser(id=request_db.user.id, name=request_db.user.name, email=request_db.user.email, avatar=request_db.user.avatar)
-        return RedemptionRequest(id=request_db.id, user=user, amount=request_db.amount, paymentDetails=request_db.paymentDetails, status=request_db.status, requestedAt=request_db.requestedAt.isoformat(), updatedAt=request_db.updatedAt.isoformat() if request_db.updatedAt else None, adminNotes=request_db.adminNotes)
+    if user:
+        return RedemptionRequest(id=request.id, user=user, amount=request.amount, paymentDetails=request.paymentDetails, status=request.status, requestedAt=requested_at, updatedAt=updated_at, adminNotes=request.adminNotes)
     else:
-        # Fallback if user relationship fails to load
+        # Fallback if the user row doesn't exist
         return request
 
 @app.put("/redemption-requests/{request_id}", response_model=RedemptionRequest)
 def update_redemption_request_status(request_id: str, request_data: Dict[str, str], db: Session = Depends(get_db)):
-    request_db = db.query(RedemptionRequestDB).options(selectinload(RedemptionRequestDB.user)).filter(RedemptionRequestDB.id == request_id).first()
+    request_db = db.query(RedemptionRequestDB).options(joinedload(RedemptionRequestDB.user)).filter(RedemptionRequestDB.id == request_id).first()
     if not request_db:
         raise HTTPException(status_code=404, detail="Request not found")
     if request_db.user is None:
@@ -1799,9 +2280,8 @@ def update_redemption_request_status(request_id: str, request_data: Dict[str, st
     new_status = request_data.get("status", request_db.status)
     old_status = request_db.status
 
-    user_db = db.query(UserDB).filter(UserDB.id == request_db.user_id).first()
-    if not user_db:
-        raise HTTPException(status_code=404, detail="User account not found")
+    # Already loaded with the request
+    user_db = request_db.user
 
     # Coins are deducted when redemption request is created
     # successfulRedemptions is incremented only when redemption is approved
@@ -1811,40 +2291,39 @@ def update_redemption_request_status(request_id: str, request_data: Dict[str, st
     if new_status == "approved" and old_status != "approved":
         # Increment successful redemptions count since this redemption is being approved
         user_db.successfulRedemptions = (user_db.successfulRedemptions or 0) + 1
-        print(f"[redemption] Approved redemption for user {user_db.id}. Successful redemptions: {user_db.successfulRedemptions}")
+        logger.info("[redemption] Approved redemption for user %s. Successful redemptions: %s", user_db.id, user_db.successfulRedemptions)
     
     # When rejecting a redemption
     elif new_status == "rejected" and old_status != "rejected":
         # Refund coins to user's account
-        user_db.coins += request_db.amount
-        print(f"[redemption] Refunded {request_db.amount} coins to user {user_db.id}. New balance: {user_db.coins}")
+        balance = adjust_user_coins(db, user_db.id, request_db.amount)
+        logger.info("[redemption] Refunded %s coins to user %s. New balance: %s", request_db.amount, user_db.id, balance)
         
         # If this was previously approved, decrement successful redemptions count
         if old_status == "approved":
             user_db.successfulRedemptions = max(0, (user_db.successfulRedemptions or 0) - 1)
-            print(f"[redemption] Decremented redemption count for user {user_db.id}. Successful redemptions: {user_db.successfulRedemptions}")
+            logger.info("[redemption] Decremented redemption count for user %s. Successful redemptions: %s", user_db.id, user_db.successfulRedemptions)
     
     # If a rejected request is being re-submitted (moved back to pending/approved)
     elif old_status == "rejected" and new_status in ["approved", "pending"]:
-        # Check if user has enough coins
-        if user_db.coins < request_db.amount:
+        # Deduct coins from user's account again, only if the balance covers it
+        balance = adjust_user_coins(db, user_db.id, -request_db.amount, require_balance=True)
+        if balance is None:
+            db.rollback()
             raise HTTPException(status_code=400, detail=f"User does not have enough coins. Current balance: {user_db.coins}, Required: {request_db.amount}")
-        
-        # Deduct coins from user's account again
-        user_db.coins -= request_db.amount
-        print(f"[redemption] Re-deducted {request_db.amount} coins from user {user_db.id} (reversing rejection). New balance: {user_db.coins}")
+        logger.info("[redemption] Re-deducted %s coins from user %s (reversing rejection). New balance: %s", request_db.amount, user_db.id, balance)
         
         # If moving to approved, increment successful redemptions
         if new_status == "approved":
             user_db.successfulRedemptions = (user_db.successfulRedemptions or 0) + 1
-            print(f"[redemption] Incremented redemption count for user {user_db.id}. Successful redemptions: {user_db.successfulRedemptions}")
+            logger.info("[redemption] Incremented redemption count for user %s. Successful redemptions: %s", user_db.id, user_db.successfulRedemptions)
     
     # If moving from approved to rejected
     elif old_status == "approved" and new_status == "rejected":
         # Refund coins and decrement successful redemptions
-        user_db.coins += request_db.amount
+        balance = adjust_user_coins(db, user_db.id, request_db.amount)
         user_db.successfulRedemptions = max(0, (user_db.successfulRedemptions or 0) - 1)
-        print(f"[redemption] Rejected previously approved redemption for user {user_db.id}. Refunded {request_db.amount} coins, decremented count. Balance: {user_db.coins}, Successful redemptions: {user_db.successfulRedemptions}")
+        logger.info("[redemption] Rejected previously approved redemption for user %s. Refunded %s coins, decremented count. Balance: %s, Successful redemptions: %s", user_db.id, request_db.amount, balance, user_db.successfulRedemptions)
 
     request_db.status = new_status
     request_db.adminNotes = request_data.get("adminNotes", request_db.adminNotes)
@@ -1855,7 +2334,7 @@ def update_redemption_request_status(request_id: str, request_data: Dict[str, st
 
 @app.get("/redemption-requests", response_model=List[RedemptionRequest])
 def get_redemption_requests(db: Session = Depends(get_db)):
-    requests_db = db.query(RedemptionRequestDB).options(selectinload(RedemptionRequestDB.user)).all()
+    requests_db = db.query(RedemptionRequestDB).options(joinedload(RedemptionRequestDB.user)).all()
     requests = []
     for req in requests_db:
         if req.user is None:
@@ -1863,11 +2342,22 @@ def get_redemption_requests(db: Session = Depends(get_db)):
             continue
         user = CommentUser(id=req.user.id, name=req.user.name, email=req.user.email, avatar=req.user.avatar)
         requests.append(RedemptionRequest(id=req.id, user=user, amount=req.amount, paymentDetails=req.paymentDetails, status=req.status, requestedAt=req.requestedAt.isoformat(), updatedAt=req.updatedAt.isoformat() if req.updatedAt else None, adminNotes=req.adminNotes))
-    return requests
-
-def db_to_comment(comment_db, db):
+    return json_response(redemption_requests_adapter, requests)
+
+def load_reply_tree(db: Session, comment_ids: List[str]) -> Dict[Optional[str], List[CommentDB]]:
+    """Comments under comment_ids (any depth) with their users, grouped by parent_id, in one query"""
+    children: Dict[Optional[str], List[CommentDB]] = defaultdict(list)
+    if comment_ids:
+        subtree = db.query(CommentDB).options(joinedload(CommentDB.user)).filter(CommentDB.id.in_(comment_subtree_ids(*comment_ids))).all()
+        for c in subtree:
+            children[c.parent_id].append(c)
+    return children
+
+def db_to_comment(comment_db, db, children: Optional[Dict[Optional[str], List[CommentDB]]] = None):
+    if children is None:
+        children = load_reply_tree(db, [comment_db.id])
     user = CommentUser(id=comment_db.user.id, name=comment_db.user.name, email=comment_db.user.email, avatar=comment_db.user.avatar)
-    replies = [db_to_comment(r, db) for r in db.query(CommentDB).filter(CommentDB.parent_id == comment_db.id).all()]
+    replies = [db_to_comment(r, db, children) for r in children.get(comment_db.id, [])]
     return Comment(id=comment_db.id, user=user, text=comment_db.text, audio_url=comment_db.audio_url, timestamp=comment_db.timestamp.isoformat(), likes=comment_db.likes, replies=replies, flaggedForReview=comment_db.flaggedForReview, reviewReason=comment_db.reviewReason)
 
 @app.post("/game-results", response_model=GameResult)
@@ -1879,34 +2369,30 @@ def save_game_result(game_result: GameResult, db: Session = Depends(get_db)):
         actualTime=game_result.actualTime,
         accuracy=game_result.accuracy,
         coinsWon=game_result.coinsWon,
-        playedAt=date_parser.parse(game_result.playedAt)
+        playedAt=parse_timestamp(game_result.playedAt)
     )
     db.add(game_result_db)
     
     # Update user's coins if coins were won (with logging)
     if game_result.coinsWon > 0:
-        user_db = db.query(UserDB).filter(UserDB.id == game_result.user.id).first()
-        if user_db:
-            try:
-                before = int(user_db.coins or 0)
-            except Exception:
-                before = 0
-            after = before + int(game_result.coinsWon)
-            user_db.coins = after
-            print(f"[coins] save_game_result: user={game_result.user.id} coinsWon={game_result.coinsWon} before={before} after={after}")
+        after = adjust_user_coins(db, game_result.user.id, int(game_result.coinsWon))
+        if after is not None:
+            logger.info("[coins] save_game_result: user=%s coinsWon=%s after=%s", game_result.user.id, game_result.coinsWon, after)
     
     db.commit()
     return game_result
 
 @app.get("/game-results/{user_id}", response_model=List[GameResult])
 def get_user_game_results(user_id: str, db: Session = Depends(get_db)):
-    game_results_db = db.query(GameResultDB).options(selectinload(GameResultDB.user)).filter(GameResultDB.user_id == user_id).order_by(GameResultDB.playedAt.desc()).all()
+    # Every row belongs to the same user: load it once instead of eager-loading it per row
+    user_db = db.query(UserDB).filter(UserDB.id == user_id).first()
+    if user_db is None:
+        # Game results with a missing user are skipped
+        return json_response(game_results_adapter, [])
+    user = CommentUser(id=user_db.id, name=user_db.name, email=user_db.email, avatar=user_db.avatar)
+    game_results_db = db.query(GameResultDB).filter(GameResultDB.user_id == user_id).order_by(GameResultDB.playedAt.desc()).all()
     results = []
     for gr in game_results_db:
-        if gr.user is None:
-            # Skip game results with missing users
-            continue
-        user = CommentUser(id=gr.user.id, name=gr.user.name, email=gr.user.email, avatar=gr.user.avatar)
         results.append(GameResult(
             id=gr.id,
             user=user,
@@ -1916,7 +2402,7 @@ def get_user_game_results(user_id: str, db: Session = Depends(get_db)):
             coinsWon=gr.coinsWon,
             playedAt=gr.playedAt.isoformat()
         ))
-    return results
+    return json_response(game_results_adapter, results)
 
 @app.get("/game-results/{user_id}/today-count")
 def get_user_today_game_count(user_id: str, db: Session = Depends(get_db)):
@@ -1926,12 +2412,13 @@ def get_user_today_game_count(user_id: str, db: Session = Depends(get_db)):
     today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
     today_end = today_start + timedelta(days=1)
 
-    # Query for games played today (UTC time)
-    today_games_count = db.query(GameResultDB).filter(
+    # Query for games played today; aware bounds are interpreted the same way playedAt was stored.
+    # COUNT(*) over (user_id, playedAt) is answered from ix_game_results_user_playedat alone.
+    today_games_count = db.query(func.count()).select_from(GameResultDB).filter(
         GameResultDB.user_id == user_id,
         GameResultDB.playedAt >= today_start,
         GameResultDB.playedAt < today_end
-    ).count()
+    ).scalar()
 
     return {
         "count": today_games_count,
@@ -1958,6 +2445,7 @@ def store_device_token(token_data: DeviceToken, db: Session = Depends(get_db)):
         if changed:
             try:
                 db.commit()
+                invalidate_device_tokens()
             except Exception:
                 db.rollback()
         return DeviceToken(
@@ -1973,11 +2461,12 @@ def store_device_token(token_data: DeviceToken, db: Session = Depends(get_db)):
         user_id=token_data.user_id,
         token=token_data.token,
         platform=token_data.platform,
-        createdAt=date_parser.parse(token_data.createdAt) if token_data.createdAt else datetime.now(IST)
+        createdAt=parse_timestamp(token_data.createdAt) if token_data.createdAt else datetime.now(IST)
     )
     db.add(token_db)
     try:
         db.commit()
+        invalidate_device_tokens()
     except IntegrityError:
         db.rollback()
         # Token was inserted concurrently; fetch and return it
@@ -2000,62 +2489,65 @@ def store_device_token(token_data: DeviceToken, db: Session = Depends(get_db)):
         createdAt=(token_db.createdAt.astimezone(IST).isoformat() if hasattr(token_db.createdAt, 'astimezone') and token_db.createdAt.tzinfo else token_db.createdAt.isoformat() if token_db.createdAt else datetime.now(IST).isoformat())
     )
 
+def load_voters(db: Session, poll_ids: List[str]) -> Dict[str, List[Dict[str, str]]]:
+    """id/name/email of every voter on the given polls, keyed by option id (one votes-users join)"""
+    voters: Dict[str, List[Dict[str, str]]] = defaultdict(list)
+    if not poll_ids:
+        return voters
+    rows = db.query(VoteDB.option_id, UserDB.id, UserDB.name, UserDB.email)\
+        .join(UserDB, UserDB.id == VoteDB.user_id)\
+        .filter(VoteDB.poll_id.in_(poll_ids))\
+        .all()
+    for option_id, user_id, name, email in rows:
+        voters[option_id].append({"id": user_id, "name": name, "email": email})
+    return voters
+
+def options_with_voters(options, voters_by_option: Dict[str, List[Dict[str, str]]]) -> List[Dict[str, Any]]:
+    return [
+        {
+            "id": option.id,
+            "text": option.text,
+            "votes": option.votes,
+            "voters": voters_by_option.get(option.id, []),
+        }
+        for option in options
+    ]
+
+def load_comment_stats(db: Session, poll_ids: List[str]):
+    """Comment count (replies included) and distinct commenters per poll, one grouped query each"""
+    if not poll_ids:
+        return {}, {}
+    counts = dict(
+        db.query(CommentDB.poll_id, func.count(CommentDB.id))
+        .filter(CommentDB.poll_id.in_(poll_ids))
+        .group_by(CommentDB.poll_id)
+        .all()
+    )
+    commenters: Dict[str, List[Dict[str, str]]] = defaultdict(list)
+    rows = db.query(CommentDB.poll_id, UserDB.id, UserDB.name, UserDB.email, UserDB.avatar)\
+        .join(UserDB, CommentDB.user_id == UserDB.id)\
+        .filter(CommentDB.poll_id.in_(poll_ids))\
+        .distinct()\
+        .all()
+    for poll_id, user_id, name, email, avatar in rows:
+        commenters[poll_id].append({"id": user_id, "name": name, "email": email, "avatar": avatar})
+    return counts, commenters
+
 @app.get("/analytics/polls")
 def get_poll_analytics(db: Session = Depends(get_db)):
     """Get analytics data for all polls"""
-    polls = db.query(PollDB).options(
-        selectinload(PollDB.comments).selectinload(CommentDB.user),
-        selectinload(PollDB.options)
-    ).all()
+    polls = db.query(PollDB).options(selectinload(PollDB.options)).all()
     analytics = []
+    # Voter details, comment counts and commenters for every poll in one query each
+    poll_ids = [poll.id for poll in polls]
+    voters_by_option = load_voters(db, poll_ids)
+    comment_counts, commenters_by_poll = load_comment_stats(db, poll_ids)
     
     for poll in polls:
         total_votes = sum(option.votes for option in poll.options)
-        total_comments = len(poll.comments)
-        
-        # Count all replies recursively
-        def count_replies(comments):
-            count = 0
-            for comment in comments:
-                count += 1
-                if comment.replies:
-                    count += count_replies(comment.replies)
-            return count
-        
-        total_comments = count_replies(poll.comments)
-        
-        # Get voter details for each option
-        options_analytics = []
-        for option in poll.options:
-            voters = []
-            if option.votedBy:
-                voter_ids = json.loads(option.votedBy)
-                for voter_id in voter_ids:
-                    user = db.query(UserDB).filter(UserDB.id == voter_id).first()
-                    if user:
-                        voters.append({
-                            "id": user.id,
-                            "name": user.name,
-                            "email": user.email
-                        })
-            
-            options_analytics.append({
-                "id": option.id,
-                "text": option.text,
-                "votes": option.votes,
-                "voters": voters
-            })
-        
-        # Get all unique commenters (including those who replied recursively)
-        # Load all comments for this poll to ensure we get all replies
-        all_comments = db.query(CommentDB).options(selectinload(CommentDB.user)).filter(CommentDB.poll_id == poll.id).all()
-        
-        commenters_set = set()
-        for comment in all_comments:
-            user = CommentUser(id=comment.user.id, name=comment.user.name, email=comment.user.email, avatar=comment.user.avatar)
-            commenters_set.add((user.id, user.name, user.email, user.avatar))
-        
-        commenters = [{"id": c[0], "name": c[1], "email": c[2], "avatar": c[3]} for c in commenters_set]
+        total_comments = comment_counts.get(poll.id, 0)
+        options_analytics = options_with_voters(poll.options, voters_by_option)
+        commenters = commenters_by_poll.get(poll.id, [])
         
         analytics.append({
             "id": poll.id,
@@ -2069,63 +2561,26 @@ def get_poll_analytics(db: Session = Depends(get_db)):
             "commenters": commenters
         })
     
-    return analytics
+    return json_response(analytics_adapter, analytics)
 
 @app.get("/analytics/polls/{poll_id}")
 def get_poll_detailed_analytics(poll_id: str, db: Session = Depends(get_db)):
     """Get detailed analytics for a specific poll"""
-    poll = db.query(PollDB).options(
-        selectinload(PollDB.comments).selectinload(CommentDB.user),
-        selectinload(PollDB.options)
-    ).filter(PollDB.id == poll_id).first()
+    poll = db.query(PollDB).options(selectinload(PollDB.options)).filter(PollDB.id == poll_id).first()
     if not poll:
         raise HTTPException(status_code=404, detail="Poll not found")
     
     total_votes = sum(option.votes for option in poll.options)
     
-    # Count all replies recursively
-    def count_replies(comments):
-        count = 0
-        for comment in comments:
-            count += 1
-            if comment.replies:
-                count += count_replies(comment.replies)
-        return count
-    
-    total_comments = count_replies(poll.comments)
-    
-    # Get voter details for each option
-    options_analytics = []
-    for option in poll.options:
-        voters = []
-        if option.votedBy:
-            voter_ids = json.loads(option.votedBy)
-            for voter_id in voter_ids:
-                user = db.query(UserDB).filter(UserDB.id == voter_id).first()
-                if user:
-                    voters.append({
-                        "id": user.id,
-                        "name": user.name,
-                        "email": user.email
-                    })
-        
-        options_analytics.append({
-            "id": option.id,
-            "text": option.text,
-            "votes": option.votes,
-            "voters": voters
-        })
-    
-    # Get all unique commenters (including those who replied recursively)
-    # Load all comments for this poll to ensure we get all replies
-    all_comments = db.query(CommentDB).options(selectinload(CommentDB.user)).filter(CommentDB.poll_id == poll.id).all()
+    # Comments and replies share the poll_id, so a single COUNT covers the whole tree
+    comment_counts, commenters_by_poll = load_comment_stats(db, [poll.id])
+    total_comments = comment_counts.get(poll.id, 0)
     
-    commenters_set = set()
-    for comment in all_comments:
-        user = CommentUser(id=comment.user.id, name=comment.user.name, email=comment.user.email, avatar=comment.user.avatar)
-        commenters_set.add((user.id, user.name, user.email, user.avatar))
+    # Get voter details for each option (one IN query for all voters)
+    options_analytics = options_with_voters(poll.options, load_voters(db, [poll.id]))
     
-    commenters = [{"id": c[0], "name": c[1], "email": c[2], "avatar": c[3]} for c in commenters_set]
+    # All unique commenters (including those who only replied)
+    commenters = commenters_by_poll.get(poll.id, [])
     
     return {
         "id": poll.id,
@@ -2140,6 +2595,40 @@ def get_poll_detailed_analytics(poll_id: str, db: Session = Depends(get_db)):
         "commenters": commenters
     }
 
+def build_multicast_message(platform: str, tokens: List[str], title: str, body: str) -> messaging.MulticastMessage:
+    message = messaging.MulticastMessage(
+        notification=messaging.Notification(
+            title=title,
+            body=body,
+        ),
+        tokens=tokens,
+    )
+
+    if platform == "android":
+        message.android = messaging.AndroidConfig(
+            priority="high",
+            notification=messaging.AndroidNotification(
+                channel_id="default",
+                priority="high",
+                default_sound=True,
+                default_vibrate_timings=True,
+            ),
+        )
+    elif platform == "ios":
+        message.apns = messaging.APNSConfig(
+            payload=messaging.APNSPayload(
+                aps=messaging.Aps(
+                    alert=messaging.ApsAlert(
+                        title=title,
+                        body=body,
+                    ),
+                    badge=1,
+                    sound="default",
+                ),
+            ),
+        )
+    return message
+
 @app.post("/send-push-notification")
 def send_push_notification(notification_data: Dict[str, str], db: Session = Depends(get_db)):
     """Send push notification to all registered device tokens using FCM"""
@@ -2150,74 +2639,72 @@ def send_push_notification(notification_data: Dict[str, str], db: Session = Depe
         raise HTTPException(status_code=400, detail="Notification body cannot be empty")
 
     # Get all device tokens
-    device_tokens = db.query(DeviceTokenDB).all()
+    device_tokens = load_device_tokens(db)
 
     if not device_tokens:
         return {"message": "No device tokens found", "sent_count": 0}
 
-    if not firebase_admin._apps:
+    if get_firebase_app() is None:
         raise HTTPException(status_code=500, detail="Firebase not initialized. Please configure Firebase credentials.")
 
     sent_count = 0
     failed_count = 0
     failed_tokens = []
+    invalid_tokens = []
+
+    # Group tokens by platform (platform-specific config is per message), then send in FCM-sized batches
+    tokens_by_platform: Dict[str, List[str]] = defaultdict(list)
+    for token, platform in device_tokens:
+        tokens_by_platform[(platform or "").lower()].append(token)
 
-    # Send notifications one by one
-    for token_record in device_tokens:
+    batches = [
+        (platform, tokens[i:i + FCM_MULTICAST_LIMIT])
+        for platform, tokens in tokens_by_platform.items()
+        for i in range(0, len(tokens), FCM_MULTICAST_LIMIT)
+    ]
+
+    def send_batch(platform: str, chunk: List[str]):
         try:
-            message = messaging.Message(
-                notification=messaging.Notification(
-                    title=title,
-                    body=body,
-                ),
-                token=token_record.token,
-            )
+            return messaging.send_each_for_multicast(build_multicast_message(platform, chunk, title, body)), None
+        except Exception as e:
+            return None, e
 
-            if token_record.platform.lower() == "android":
-                message.android = messaging.AndroidConfig(
-                    priority="high",
-                    notification=messaging.AndroidNotification(
-                        channel_id="default",
-                        priority="high",
-                        default_sound=True,
-                        default_vibrate_timings=True,
-                    ),
-                )
-            elif token_record.platform.lower() == "ios":
-                message.apns = messaging.APNSConfig(
-                    payload=messaging.APNSPayload(
-                        aps=messaging.Aps(
-                            alert=messaging.ApsAlert(
-                                title=title,
-                                body=body,
-                            ),
-                            badge=1,
-                            sound="default",
-                        ),
-                    ),
-                )
+    # firebase_admin is blocking: send the batches concurrently instead of one round-trip after another
+    with ThreadPoolExecutor(max_workers=min(FCM_MAX_PARALLEL_BATCHES, len(batches))) as pool:
+        results = list(pool.map(lambda b: send_batch(*b), batches))
 
-            response = messaging.send(message)
-            sent_count += 1
-            print(f"Notification sent successfully to {token_record.token}")
+    for (platform, chunk), (batch, error) in zip(batches, results):
+        if error is not None:
+            failed_count += len(chunk)
+            failed_tokens.extend({"token": t, "platform": platform, "error": str(error)} for t in chunk)
+            logger.warning("Failed to send notification batch of %s (%s): %s", len(chunk), platform, error)
+            continue
 
-        except Exception as e:
-            failed_count += 1
-            failed_tokens.append({
-                "token": token_record.token,
-                "platform": token_record.platform,
-                "error": str(e)
-            })
-            print(f"Failed to send notification to {token_record.token}: {e}")
+        sent_count += batch.success_count
+        failed_count += batch.failure_count
+        for token, resp in zip(chunk, batch.responses):
+            if resp.success:
+                continue
+            failed_tokens.append({"token": token, "platform": platform, "error": str(resp.exception)})
+            if isinstance(resp.exception, (messaging.UnregisteredError, messaging.SenderIdMismatchError)):
+                invalid_tokens.append(token)
+        logger.info("Notification batch sent (%s): %s/%s succeeded", platform, batch.success_count, len(chunk))
+
+    # Prune tokens FCM reports as no longer valid
+    if invalid_tokens:
+        db.query(DeviceTokenDB).filter(DeviceTokenDB.token.in_(invalid_tokens)).delete(synchronize_session=False)
+        db.commit()
+        invalidate_device_tokens()
+        logger.info("Removed %s invalid device tokens", len(invalid_tokens))
 
     # Log results
-    print(f"Push notification sent: {title}")
-    print(f"Total tokens: {len(device_tokens)}")
-    print(f"Successful sends: {sent_count}")
-    print(f"Failed sends: {failed_count}")
+    logger.info("Push notification sent: %s", title)
+    logger.info("Total tokens: %s", len(device_tokens))
+    logger.info("Successful sends: %s", sent_count)
+    logger.info("Failed sends: %s", failed_count)
 
     if failed_tokens:
-        print("Failed tokens:", failed_tokens)
+        logger.warning("Failed tokens: %s", failed_tokens)
 
     return {
         "message": f"Notification sent to {sent_count} devices successfully",
@@ -2235,37 +2722,41 @@ def put_public_key(user_id: str, body: PublicKeyBody, db: Session = Depends(get_
     user = db.query(UserDB).filter(UserDB.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    existing = db.query(UserPublicKeyDB).filter(UserPublicKeyDB.user_id == user_id).first()
-    now = datetime.now(IST)
-    as_text = json.dumps(body.publicKeyJwk)
-    if existing:
-        existing.public_jwk = as_text
-        existing.updatedAt = now
-    else:
-        db.add(UserPublicKeyDB(user_id=user_id, public_jwk=as_text, updatedAt=now))
+    stmt = upsert_insert(UserPublicKeyDB).values(user_id=user_id, public_jwk=to_json(body.publicKeyJwk).decode(), updatedAt=datetime.now(IST))
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["user_id"],
+        set_={"public_jwk": stmt.excluded.public_jwk, "updatedAt": stmt.excluded.updatedAt},
+    ))
     db.commit()
     return {"success": True}
 
 @app.get("/users/{user_id}/public-key")
-def get_public_key(user_id: str, db: Session = Depends(get_db)):
-    rec = db.query(UserPublicKeyDB).filter(UserPublicKeyDB.user_id == user_id).first()
+def get_public_key(user_id: str, if_none_match: Optional[str] = Header(None), db: Session = Depends(get_db)):
+    rec = db.query(UserPublicKeyDB.public_jwk, UserPublicKeyDB.updatedAt).filter(UserPublicKeyDB.user_id == user_id).first()
     if not rec:
         raise HTTPException(status_code=404, detail="Public key not found")
+    # Keys rarely change: revalidate by ETag (derived from the stored key and its timestamp) and skip the body on a match
+    updated_iso = rec.updatedAt.isoformat() if rec.updatedAt else ""
+    digest = hashlib.blake2b(f"{rec.public_jwk}|{updated_iso}".encode(), digest_size=8).hexdigest()
+    headers = {"ETag": f'W/"{digest}"', "Cache-Control": "private, max-age=60"}
+    if if_none_match:
+        candidates = {tag.strip() for tag in if_none_match.split(",")}
+        if "*" in candidates or headers["ETag"] in candidates or f'"{digest}"' in candidates:
+            return Response(status_code=304, headers=headers)
+    # pydantic-core's Rust JSON codec both ways; the Response skips FastAPI's jsonable_encoder pass
     try:
-        jwk = json.loads(rec.public_jwk)
+        jwk = from_json(rec.public_jwk)
     except Exception:
         jwk = rec.public_jwk
-    return {"publicKeyJwk": jwk, "updatedAt": rec.updatedAt.isoformat() if rec.updatedAt else None}
+    body = {"publicKeyJwk": jwk, "updatedAt": updated_iso or None}
+    return Response(content=to_json(body), media_type="application/json", headers=headers)
 
 @app.post("/messages")
 def send_message(body: SendMessageBody, db: Session = Depends(get_db)):
     # Validate users
-    if not db.query(UserDB).filter(UserDB.id == body.senderId).first():
-        raise HTTPException(status_code=404, detail="Sender not found")
-    if not db.query(UserDB).filter(UserDB.id == body.recipientId).first():
-        raise HTTPException(status_code=404, detail="Recipient not found")
+    ensure_message_users(db, body.senderId, body.recipientId)
 
-    created_at = date_parser.parse(body.createdAt)
+    created_at = parse_timestamp(body.createdAt)
     msg = MessageDB(
         id=body.id,
         sender_id=body.senderId,
@@ -2280,119 +2771,93 @@ def send_message(body: SendMessageBody, db: Session = Depends(get_db)):
     db.commit()
     return {"success": True}
 
-@app.get("/conversations/{user_id}", response_model=List[ConversationItem])
-def list_conversations(user_id: str, db: Session = Depends(get_db)):
-    # Fetch peers where user is sender or recipient
-    sent = db.query(MessageDB.recipient_id.label("peer"))\
-        .filter(MessageDB.sender_id == user_id)
-    received = db.query(MessageDB.sender_id.label("peer"))\
-        .filter(MessageDB.recipient_id == user_id)
-
-    peers = set([row.peer for row in sent.union_all(received).all()])
-
-    items: List[ConversationItem] = []
-    for peer in peers:
-        last = db.query(MessageDB).filter(
-            ((MessageDB.sender_id == user_id) & (MessageDB.recipient_id == peer)) |
-            ((MessageDB.sender_id == peer) & (MessageDB.recipient_id == user_id))
-        ).order_by(MessageDB.createdAt.desc()).first()
-        if not last:
-            continue
-        unread = db.query(MessageDB).filter(
-            (MessageDB.recipient_id == user_id) & (MessageDB.sender_id == peer) & (MessageDB.readAt == None)
-        ).count()
-        items.append(ConversationItem(
-            peerId=peer,
-            lastMessageAt=last.createdAt.isoformat(),
-            unreadCount=unread,
-        ))
-    # Sort by lastMessageAt desc
-    items.sort(key=lambda x: x.lastMessageAt, reverse=True)
-    return items
+@app.post("/messages/bulk")
+def send_messages_bulk(body: BulkMessagesBody, db: Session = Depends(get_db)):
+    """Store a backlog of messages with one user lookup and one multi-row INSERT."""
+    if not body.messages:
+        return {"success": True, "count": 0, "inserted": []}
+    user_ids = {m.senderId for m in body.messages} | {m.recipientId for m in body.messages}
+    known = {row[0] for row in db.query(UserDB.id).filter(UserDB.id.in_(user_ids)).all()}
+    for m in body.messages:
+        if m.senderId not in known:
+            raise HTTPException(status_code=404, detail="Sender not found")
+        if m.recipientId not in known:
+            raise HTTPException(status_code=404, detail="Recipient not found")
+
+    rows = [
+        {
+            "id": m.id,
+            "sender_id": m.senderId,
+            "recipient_id": m.recipientId,
+            "ciphertext": m.ciphertextBase64,
+            "iv": m.ivBase64,
+            "createdAt": parse_timestamp(m.createdAt),
+            "delivered": True,
+            "readAt": None,
+            "audioUrl": None,
+            "audioDuration": 0.0,
+        }
+        for m in body.messages
+    ]
+    try:
+        if engine.dialect.insert_executemany_returning:
+            # Echo back what was stored from the INSERT itself (multi-row VALUES ... RETURNING)
+            inserted = db.execute(insert(MessageDB).returning(MessageDB.id, MessageDB.createdAt), rows).all()
+        else:
+            db.execute(insert(MessageDB), rows)
+            # Read the stored values back so both branches echo what the column holds
+            stored = dict(db.execute(
+                select(MessageDB.id, MessageDB.createdAt).where(MessageDB.id.in_([r["id"] for r in rows]))
+            ).all())
+            inserted = [(r["id"], stored[r["id"]]) for r in rows]
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Message already exists")
+    return {
+        "success": True,
+        "count": len(inserted),
+        "inserted": [{"id": msg_id, "createdAt": created_at.isoformat()} for msg_id, created_at in inserted],
+    }
 
-@app.get("/messages/thread", response_model=List[MessageItem])
-def get_thread(userA: str = Query(...), userB: str = Query(...), after: Optional[str] = None, limit: int = Query(50, ge=1, le=200), db: Session = Depends(get_db)):
-    q = db.query(MessageDB).filter(
+def load_thread(db: Session, userA: str, userB: str, after: Optional[str], afterId: Optional[str], limit: int) -> List[MessageItem]:
+    # Plain column rows and model_construct: no ORM hydration and no per-row validation for trusted DB values
+    stmt = select(
+        MessageDB.id, MessageDB.sender_id, MessageDB.recipient_id, MessageDB.ciphertext, MessageDB.iv,
+        MessageDB.createdAt, MessageDB.delivered, MessageDB.readAt, MessageDB.audioUrl, MessageDB.audioDuration,
+    ).where(
         ((MessageDB.sender_id == userA) & (MessageDB.recipient_id == userB)) |
         ((MessageDB.sender_id == userB) & (MessageDB.recipient_id == userA))
     )
     if after:
         try:
-            after_dt = date_parser.parse(after)
-            q = q.filter(MessageDB.createdAt > after_dt)
+            after_dt = parse_timestamp(after)
+            # Keyset cursor: with afterId, messages sharing the cursor's timestamp are neither repeated nor skipped
+            if afterId:
+                stmt = stmt.where(tuple_(MessageDB.createdAt, MessageDB.id) > tuple_(after_dt, afterId))
+            else:
+                stmt = stmt.where(MessageDB.createdAt > after_dt)
         except Exception:
             pass
-    msgs = q.order_by(MessageDB.createdAt.asc()).limit(limit).all()
-    result: List[MessageItem] = []
-    for m in msgs:
-        result.append(MessageItem(
-            id=m.id,
-            senderId=m.sender_id,
-            recipientId=m.recipient_id,
-            ciphertextBase64=m.ciphertext,
-            ivBase64=m.iv,
-            createdAt=m.createdAt.isoformat(),
-            delivered=bool(m.delivered),
-            readAt=m.readAt.isoformat() if m.readAt else None,
-            audioUrl=m.audioUrl,
-            audioDuration=m.audioDuration,
-        ))
-    return result
-
-@app.post("/messages/{message_id}/read")
-def mark_message_read(message_id: str, db: Session = Depends(get_db)):
-    m = db.query(MessageDB).filter(MessageDB.id == message_id).first()
-    if not m:
-        raise HTTPException(status_code=404, detail="Message not found")
-    if not m.readAt:
-        m.readAt = datetime.now(IST)
-        db.commit()
-    return {"success": True, "readAt": m.readAt.isoformat() if m.readAt else None}
-
+    rows = db.execute(stmt.order_by(MessageDB.createdAt.asc(), MessageDB.id.asc()).limit(limit)).all()
+    return [
+        MessageItem.model_construct(
+            id=r.id,
+            senderId=r.sender_id,
+            recipientId=r.recipient_id,
+            ciphertextBase64=r.ciphertext,
+            ivBase64=r.iv,
+            createdAt=r.createdAt.isoformat(),
+            delivered=bool(r.delivered),
+            readAt=r.readAt.isoformat() if r.readAt else None,
+            audioUrl=r.audioUrl,
+            audioDuration=r.audioDuration,
+        )
+        for r in rows
+    ]
 
-# Voice message upload
-@app.post("/messages/voice")
-def upload_voice_message(
-    id: str = Form(...),
-    senderId: str = Form(...),
-    recipientId: str = Form(...),
-    createdAt: str = Form(...),
-    duration: float = Form(0.0),
-    file: UploadFile = File(...),
-    db: Session = Depends(get_db),
-):
-    # Validate users
-    sender = db.query(UserDB).filter(UserDB.id == senderId).first()
-    if not sender:
-        raise HTTPException(status_code=404, detail="Sender not found")
-    if not db.query(UserDB).filter(UserDB.id == recipientId).first():
-        raise HTTPException(status_code=404, detail="Recipient not found")
-    # Save file with extension based on content type
-    ct = (file.content_type or '').lower()
-    ext = '.webm'
-    if 'mp4' in ct or 'm4a' in ct:
-        ext = '.m4a'
-    elif 'mpeg' in ct or ct.endswith('/mp3'):
-        ext = '.mp3'
-    elif 'ogg' in ct or 'opus' in ct:
-        ext = '.ogg'
-    safe_name = f"{id}{ext}"
-    out_path = Path("uploads/voice") / safe_name
-    with open(out_path, "wb") as f:
-        f.write(file.file.read())
-    # Create message row
-    msg = MessageDB(
-        id=id,
-        sender_id=senderId,
-        recipient_id=recipientId,
-        ciphertext="",  # not used for voice
-        iv="",
-        createdAt=date_parser.parse(createdAt),
-        delivered=True,
-        readAt=None,
-        audioUrl=f"/uploads/voice/{safe_name}",
-        audioDuration=duration,
-    )
-    db.add(msg)
-    db.commit()
-    return {"success": True, "audioUrl": msg.audioUrl, "audioDuration": msg.audioDuration}
+@app.get("/messages/thread", response_model=List[MessageItem])
+async def get_thread(userA: str = Query(...), userB: str = Query(...), after: Optional[str] = None, afterId: Optional[str] = None, limit: int = Query(50, ge=1, le=200)):
+    """Page forward by passing the last message's createdAt as after and its id as afterId."""
+    body = await run_with_session(lambda db: messages_adapter.dump_json(load_thread(db, userA, userB, after, afterId, limit)))
+    return Response(content=body, media_type="application/json")
@@ -24,6 +24,18 @@ print(f"[MIGRATE] Connecting to database: {DATABASE_URL.split('@')[-1] if '@' in
 engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(bind=engine)
 
+# Indexes declared on the models in app.py (same names, so either path is idempotent)
+INDEXES = [
+    ("ix_polls_createdAt", 'CREATE INDEX IF NOT EXISTS "ix_polls_createdAt" ON polls ("createdAt")'),
+    ("ix_comments_poll_parent", "CREATE INDEX IF NOT EXISTS ix_comments_poll_parent ON comments (poll_id, parent_id)"),
+    ("ix_device_tokens_user_id", "CREATE INDEX IF NOT EXISTS ix_device_tokens_user_id ON device_tokens (user_id)"),
+    ("ix_ads_user_date", "CREATE UNIQUE INDEX IF NOT EXISTS ix_ads_user_date ON ads_stats (user_id, date)"),
+    ("ix_msg_conv", 'CREATE INDEX IF NOT EXISTS ix_msg_conv ON messages (sender_id, recipient_id, "createdAt")'),
+    ("ix_msg_recv", 'CREATE INDEX IF NOT EXISTS ix_msg_recv ON messages (recipient_id, sender_id, "createdAt")'),
+    ("ix_msg_unread", 'CREATE INDEX IF NOT EXISTS ix_msg_unread ON messages (recipient_id, sender_id) WHERE "readAt" IS NULL'),
+    ("ix_game_results_user_playedat", 'CREATE INDEX IF NOT EXISTS ix_game_results_user_playedat ON game_results (user_id, "playedAt")'),
+]
+
 def migrate():
     """Run database migrations"""
     db = SessionLocal()
@@ -33,68 +45,64 @@ def migrate():
         print(f"[MIGRATE] Database type: {'PostgreSQL' if is_postgres else 'SQLite'}")
         
         # Migration 1: Add successfulRedemptions column to users table
+        # (idempotent DDL instead of a failing probe query, which aborts the transaction on Postgres)
         print("\n[MIGRATE] Checking successfulRedemptions column...")
         try:
             if is_postgres:
-                db.execute(text('SELECT "successfulRedemptions" FROM users LIMIT 1'))
+                db.execute(text('ALTER TABLE users ADD COLUMN IF NOT EXISTS "successfulRedemptions" INTEGER DEFAULT 0'))
             else:
-                db.execute(text('SELECT successfulRedemptions FROM users LIMIT 1'))
-            db.commit()  # Commit successful check
-            print("[MIGRATE] ✓ successfulRedemptions column already exists")
+                # SQLite has no ADD COLUMN IF NOT EXISTS; read the column list once instead
+                columns = {row[1] for row in db.execute(text("PRAGMA table_info(users)")).fetchall()}
+                if "successfulRedemptions" not in columns:
+                    db.execute(text('ALTER TABLE users ADD COLUMN successfulRedemptions INTEGER DEFAULT 0'))
+            db.commit()
+            print("[MIGRATE] ✓ successfulRedemptions column ready")
         except Exception as e:
-            # CRITICAL: Rollback failed transaction before attempting ALTER
+            print(f"[MIGRATE] ✗ Failed to add column: {e}")
             db.rollback()
-            print(f"[MIGRATE] Column not found, adding it... ({type(e).__name__})")
-            try:
-                if is_postgres:
-                    db.execute(text('ALTER TABLE users ADD COLUMN "successfulRedemptions" INTEGER DEFAULT 0'))
-                else:
-                    db.execute(text('ALTER TABLE users ADD COLUMN successfulRedemptions INTEGER DEFAULT 0'))
-                db.commit()
-                print("[MIGRATE] ✓ successfulRedemptions column added successfully")
-            except Exception as e2:
-                print(f"[MIGRATE] ✗ Failed to add column: {e2}")
-                db.rollback()
         
         # Migration 2: Create otps table if it doesn't exist
         print("\n[MIGRATE] Checking otps table...")
         try:
-            db.execute(text("SELECT * FROM otps LIMIT 1"))
-            db.commit()  # Commit successful check
-            print("[MIGRATE] ✓ otps table already exists")
+            if is_postgres:
+                db.execute(text("""
+                    CREATE TABLE IF NOT EXISTS otps (
+                        id SERIAL PRIMARY KEY,
+                        email VARCHAR,
+                        otp_code VARCHAR,
+                        created_at TIMESTAMP WITH TIME ZONE,
+                        expires_at TIMESTAMP WITH TIME ZONE,
+                        is_used BOOLEAN DEFAULT FALSE
+                    )
+                """))
+            else:
+                db.execute(text("""
+                    CREATE TABLE IF NOT EXISTS otps (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        email VARCHAR,
+                        otp_code VARCHAR,
+                        created_at DATETIME,
+                        expires_at DATETIME,
+                        is_used BOOLEAN DEFAULT 0
+                    )
+                """))
+            db.commit()
+            print("[MIGRATE] ✓ otps table ready")
         except Exception as e:
-            # CRITICAL: Rollback failed transaction before attempting CREATE
+            print(f"[MIGRATE] ✗ Failed to create table: {e}")
             db.rollback()
-            print(f"[MIGRATE] Table not found, creating it... ({type(e).__name__})")
+
+        # Migration 3: Create indexes used by hot queries
+        print("\n[MIGRATE] Creating indexes...")
+        for name, ddl in INDEXES:
             try:
-                if is_postgres:
-                    db.execute(text("""
-                        CREATE TABLE otps (
-                            id SERIAL PRIMARY KEY,
-                            email VARCHAR,
-                            otp_code VARCHAR,
-                            created_at TIMESTAMP WITH TIME ZONE,
-                            expires_at TIMESTAMP WITH TIME ZONE,
-                            is_used BOOLEAN DEFAULT FALSE
-                        )
-                    """))
-                else:
-                    db.execute(text("""
-                        CREATE TABLE otps (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            email VARCHAR,
-                            otp_code VARCHAR,
-                            created_at DATETIME,
-                            expires_at DATETIME,
-                            is_used BOOLEAN DEFAULT 0
-                        )
-                    """))
+                db.execute(text(ddl))
                 db.commit()
-                print("[MIGRATE] ✓ otps table created successfully")
-            except Exception as e2:
-                print(f"[MIGRATE] ✗ Failed to create table: {e2}")
+                print(f"[MIGRATE] ✓ {name} ready")
+            except Exception as e:
+                print(f"[MIGRATE] ✗ Failed to create index {name}: {e}")
                 db.rollback()
-        
+
         print("\n[MIGRATE] Migration completed!")
         
     except Exception as e: